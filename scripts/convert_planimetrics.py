@@ -5,10 +5,22 @@ Supports years: 1996, 2004, 2014, 2022
 NYC Planimetrics data uses NAD83 / New York Long Island (ftUS) - EPSG:2263
 We need to transform to WGS84 (EPSG:4326) for web mapping
 """
-import json
-import math
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
+import numpy as np
 import shapefile
+from pyproj import Transformer
+
+from geojson_common import WRITE_BUFFER_SIZE, dumps, save_geojson
+
+try:
+    import fiona
+except ImportError:
+    fiona = None
 
 # Paths
 PLANIMETRICS_DIR = Path("NYC_Planimetrics_Historical_Data")
@@ -17,6 +29,12 @@ FRONTEND_DATA_DIR = Path("frontend/public/data/reference")
 # Create output directory
 FRONTEND_DATA_DIR.mkdir(parents=True, exist_ok=True)
 
+# Decimal places kept for projected lon/lat (~11 cm at NYC's latitude)
+COORD_PRECISION = 6
+
+# Shape records decoded and projected per batch
+RECORD_BATCH_SIZE = 50_000
+
 # Year mappings to folder names
 YEAR_FOLDERS = {
     1996: "NYC_Planimetrics_1996.gdb",
@@ -46,302 +64,375 @@ PEDESTRIAN_LAYERS = {
 
 # NYC State Plane (EPSG:2263) to WGS84 (EPSG:4326) transformation
 # EPSG:2263 parameters: NAD83 / New York Long Island (ftUS)
-# Lambert Conformal Conic projection
+# Lambert Conformal Conic projection, handled by PROJ through pyproj
+_TO_WGS84 = Transformer.from_crs("EPSG:2263", "EPSG:4326", always_xy=True)
+_TO_STATE_PLANE = Transformer.from_crs("EPSG:4326", "EPSG:2263", always_xy=True)
+
 
 def state_plane_to_wgs84(x_ft, y_ft):
     """
     Convert NY State Plane coordinates (feet) to WGS84 lat/lon
     Uses the official EPSG:2263 projection parameters
     
-    Input: x, y in US Survey Feet (EPSG:2263)
+    Input: x, y in US Survey Feet (EPSG:2263), scalars or numpy arrays
     Output: lon, lat in degrees (EPSG:4326)
     """
-    # Convert US Survey Feet to meters
-    # US Survey Foot = 1200/3937 meters
-    x = x_ft * (1200.0 / 3937.0)
-    y = y_ft * (1200.0 / 3937.0)
-    
-    # EPSG:2263 Lambert Conformal Conic parameters
-    # False Easting: 300000 m, False Northing: 0 m
-    # Standard Parallels: 40°40'N and 41°02'N  
-    # Central Meridian: -74°00'W
-    # Latitude of Origin: 40°10'N
-    
-    x0 = 300000.0  # False Easting in meters
-    y0 = 0.0       # False Northing in meters
-    lon0 = -74.0   # Central meridian
-    lat0 = 40.16666666666667  # Latitude of origin (40°10'N)
-    lat1 = 40.66666666666667  # Standard parallel 1 (40°40'N)
-    lat2 = 41.03333333333333  # Standard parallel 2 (41°02'N)
-    
-    # GRS80 ellipsoid parameters
-    a = 6378137.0  # Semi-major axis
-    f = 1/298.257222101  # Flattening
-    e2 = 2*f - f*f  # Eccentricity squared
-    e = math.sqrt(e2)
-    
-    # Convert to radians
-    lat0_r = math.radians(lat0)
-    lat1_r = math.radians(lat1)
-    lat2_r = math.radians(lat2)
-    
-    # Calculate m and t values for standard parallels
-    def calc_m(lat_r):
-        return math.cos(lat_r) / math.sqrt(1 - e2 * math.sin(lat_r)**2)
-    
-    def calc_t(lat_r):
-        sin_lat = math.sin(lat_r)
-        return math.tan(math.pi/4 - lat_r/2) / ((1 - e*sin_lat)/(1 + e*sin_lat))**(e/2)
-    
-    m1 = calc_m(lat1_r)
-    m2 = calc_m(lat2_r)
-    t0 = calc_t(lat0_r)
-    t1 = calc_t(lat1_r)
-    t2 = calc_t(lat2_r)
-    
-    # Calculate n (cone constant)
-    n = (math.log(m1) - math.log(m2)) / (math.log(t1) - math.log(t2))
-    
-    # Calculate F
-    F = m1 / (n * t1**n)
-    
-    # Calculate rho0
-    rho0 = a * F * t0**n
-    
-    # Inverse projection
-    x_shifted = x - x0
-    y_shifted = y - y0
-    
-    rho = math.sqrt(x_shifted**2 + (rho0 - y_shifted)**2)
-    if n < 0:
-        rho = -rho
-    
-    theta = math.atan2(x_shifted, rho0 - y_shifted)
-    
-    # Calculate longitude
-    lon = lon0 + math.degrees(theta / n)
-    
-    # Calculate latitude iteratively
-    t = (rho / (a * F)) ** (1/n)
-    
-    # Initial latitude estimate
-    lat = math.pi/2 - 2 * math.atan(t)
-    
-    # Iterate to refine latitude
-    for _ in range(10):
-        sin_lat = math.sin(lat)
-        lat_new = math.pi/2 - 2 * math.atan(
-            t * ((1 - e*sin_lat)/(1 + e*sin_lat))**(e/2)
-        )
-        if abs(lat_new - lat) < 1e-12:
-            break
-        lat = lat_new
-    
-    lat = math.degrees(lat)
-    
-    return lon, lat
-
-
-def transform_coordinates(coords, geom_type):
-    """Transform coordinates from State Plane to WGS84"""
-    if geom_type == 'Point':
-        return list(state_plane_to_wgs84(coords[0], coords[1]))
-    elif geom_type == 'LineString':
-        return [list(state_plane_to_wgs84(c[0], c[1])) for c in coords]
-    elif geom_type == 'Polygon':
-        return [[list(state_plane_to_wgs84(c[0], c[1])) for c in ring] for ring in coords]
-    elif geom_type == 'MultiPoint':
-        return [list(state_plane_to_wgs84(c[0], c[1])) for c in coords]
-    elif geom_type == 'MultiLineString':
-        return [[list(state_plane_to_wgs84(c[0], c[1])) for c in line] for line in coords]
-    elif geom_type == 'MultiPolygon':
-        return [[[list(state_plane_to_wgs84(c[0], c[1])) for c in ring] for ring in poly] for poly in coords]
-    return coords
-
-
-def shapefile_to_geojson(shp_path, layer_name, year, bbox=None):
-    """Convert a shapefile to GeoJSON format with coordinate transformation"""
+    return _TO_WGS84.transform(x_ft, y_ft)
+
+
+@lru_cache(maxsize=None)
+def bbox_to_state_plane(bbox):
+    """
+    Envelope of a WGS84 bbox in EPSG:2263 feet, cached per bbox
+
+    Input: (min_lat, max_lat, min_lon, max_lon) tuple
+    Output: (min_x, min_y, max_x, max_y) in US Survey Feet
+
+    Edges are densified before taking the envelope, since parallels project
+    to arcs; the result always contains the projected bbox.
+    """
+    min_lat, max_lat, min_lon, max_lon = bbox
+    return _TO_STATE_PLANE.transform_bounds(min_lon, min_lat, max_lon, max_lat, densify_pts=21)
+
+
+def project_layer(shapes):
+    """
+    Project the vertices of many pyshp shapes with a single PROJ call
+
+    Returns one (N, 2) lon/lat array per shape, in input order, rounded to
+    COORD_PRECISION places; the arrays are views into one contiguous buffer
+    """
+    counts = [len(shape.points) for shape in shapes]
+    if not sum(counts):
+        return [np.empty((0, 2)) for _ in shapes]
+
+    xy = np.concatenate([
+        np.asarray(shape.points, dtype=np.float64)[:, :2]
+        for shape in shapes if shape.points
+    ])
+    lon, lat = state_plane_to_wgs84(xy[:, 0], xy[:, 1])
+    lonlat = np.round(np.column_stack([lon, lat]), COORD_PRECISION)
+
+    return np.split(lonlat, np.cumsum(counts)[:-1])
+
+
+def _split_parts(shape, out):
+    """Split a shape's flat points (array or list) into one run per part"""
+    starts = list(shape.parts)
+    return [out[i:j] for i, j in zip(starts, starts[1:] + [len(out)])]
+
+
+def _build_point(shape, out):
+    return {"type": "Point", "coordinates": out[0]}
+
+
+def _build_multipoint(shape, out):
+    return {"type": "MultiPoint", "coordinates": out}
+
+
+def _build_polyline(shape, out):
+    runs = _split_parts(shape, out)
+    if len(runs) == 1:
+        return {"type": "LineString", "coordinates": runs[0]}
+    return {"type": "MultiLineString", "coordinates": runs}
+
+
+def _build_polygon(shape, out):
+    # A single ring is the polygon whatever its winding; only multi-ring
+    # shapes need pyshp to sort exteriors from holes, on plain lists
+    if len(shape.parts) == 1:
+        return {"type": "Polygon", "coordinates": [out]}
+    polys = shapefile.organize_polygon_rings(_split_parts(shape, out.tolist()))
+    if len(polys) == 1:
+        return {"type": "Polygon", "coordinates": polys[0]}
+    return {"type": "MultiPolygon", "coordinates": polys}
+
+
+# Geometry builders keyed on the pyshp shapeType, including M and Z variants
+_BUILDERS = {
+    shapefile.POINT: _build_point,
+    shapefile.POINTM: _build_point,
+    shapefile.POINTZ: _build_point,
+    shapefile.MULTIPOINT: _build_multipoint,
+    shapefile.MULTIPOINTM: _build_multipoint,
+    shapefile.MULTIPOINTZ: _build_multipoint,
+    shapefile.POLYLINE: _build_polyline,
+    shapefile.POLYLINEM: _build_polyline,
+    shapefile.POLYLINEZ: _build_polyline,
+    shapefile.POLYGON: _build_polygon,
+    shapefile.POLYGONM: _build_polygon,
+    shapefile.POLYGONZ: _build_polygon,
+}
+
+
+def shape_to_geometry(shape, lonlat):
+    """
+    Build a GeoJSON geometry from a pyshp shape and its projected points
+
+    Uses the shape's part offsets instead of going through __geo_interface__;
+    lonlat holds the already transformed points of shape.points. Coordinates
+    stay (N, 2) array slices of it, which dumps writes without first
+    building nested [lon, lat] lists
+    """
+    build = _BUILDERS.get(shape.shapeType)
+    if build is None or not len(lonlat):
+        return None
+    return build(shape, lonlat)
+
+
+def shapefile_to_geojson(shp_path, layer_name, year, output_path, bbox=None, sp_bbox=None):
+    """
+    Convert a shapefile to GeoJSON features with coordinate transformation
+
+    Features are serialized as they are built and written to output_path one
+    per line, so a worker process hands back only a count, never the layer's
+    features. Returns the number of features written; 0 (and no file) when
+    the layer can't be read.
+    sp_bbox is bbox projected to State Plane feet; it is handed to the reader
+    so shapes whose native bounds miss it are never decoded or projected
+    """
     try:
         sf = shapefile.Reader(str(shp_path))
     except Exception as e:
         print(f"    Error reading shapefile: {e}")
-        return None
+        return 0
     
-    features = []
+    count = 0
     fields = [field[0] for field in sf.fields[1:]]
-    
-    for sr in sf.shapeRecords():
-        try:
-            geom = sr.shape.__geo_interface__
-            if not geom or not geom.get('coordinates'):
-                continue
-        except Exception:
-            continue
-        
-        # Transform coordinates to WGS84
-        geom_type = geom['type']
-        try:
-            transformed_coords = transform_coordinates(geom['coordinates'], geom_type)
-            geom['coordinates'] = transformed_coords
-        except Exception as e:
-            continue
-        
-        # Apply bbox filter after transformation (now in WGS84)
-        if bbox:
-            if not coords_in_bbox(geom['coordinates'], bbox):
-                continue
-        
-        # Get properties
-        try:
-            props = dict(zip(fields, sr.record))
-        except:
-            props = {}
-        
-        # Clean up properties
-        clean_props = {}
-        for k, v in props.items():
-            if isinstance(v, (int, float, str, bool, type(None))):
-                clean_props[k] = v
-            else:
-                clean_props[k] = str(v)
-        
-        clean_props['_source_layer'] = layer_name
-        clean_props['_source_year'] = year
-        clean_props['_source'] = 'NYC_Planimetrics'
-        
-        feature = {
-            "type": "Feature",
-            "geometry": geom,
-            "properties": clean_props
-        }
-        features.append(feature)
-    
-    return {
-        "type": "FeatureCollection",
-        "features": features,
-        "metadata": {
-            "source": "NYC Planimetrics Historical Data",
-            "year": year,
-            "layer": layer_name,
-            "feature_count": len(features)
-        }
-    }
+    # Character, numeric, float and logical columns already decode to JSON
+    # types; dates (and anything more exotic) are stringified per column
+    needs_str = [field[1] not in ('C', 'N', 'F', 'L') for field in sf.fields[1:]]
+    
+    with sf, open(output_path, 'wb', buffering=WRITE_BUFFER_SIZE) as out:
+        # pyshp compares each record's stored bounds against sp_bbox and only
+        # parses the points and attributes of shapes that can overlap it; records
+        # are pulled lazily in bounded batches so peak memory stays flat
+        records = sf.iterShapeRecords(bbox=sp_bbox)
+        while True:
+            shape_records = list(islice(records, RECORD_BATCH_SIZE))
+            if not shape_records:
+                break
+            
+            # Transform every vertex of the batch to WGS84 in one call
+            try:
+                projected = project_layer([sr.shape for sr in shape_records])
+            except Exception as e:
+                print(f"    Error transforming shapefile: {e}")
+                count = 0
+                break
+            
+            for sr, lonlat in zip(shape_records, projected):
+                # Apply bbox filter after transformation (now in WGS84)
+                if bbox and len(lonlat) and not coords_in_bbox(lonlat, bbox):
+                    continue
+
+                # Build the geometry from the projected points
+                try:
+                    geom = shape_to_geometry(sr.shape, lonlat)
+                    if not geom:
+                        continue
+                except Exception:
+                    continue
+                
+                # Get properties
+                try:
+                    clean_props = {
+                        k: (str(v) if ns and v is not None else v)
+                        for k, ns, v in zip(fields, needs_str, sr.record)
+                    }
+                except:
+                    clean_props = {}
+                
+                clean_props['_source_layer'] = layer_name
+                clean_props['_source_year'] = year
+                clean_props['_source'] = 'NYC_Planimetrics'
+                
+                feature = {
+                    "type": "Feature",
+                    "geometry": geom,
+                    "properties": clean_props
+                }
+                out.write(dumps(feature))
+                out.write(b'\n')
+                count += 1
+    
+    if not count:
+        Path(output_path).unlink(missing_ok=True)
+    return count
+
 
+def coords_in_bbox(lonlat, bbox, chunk_size=4096):
+    """
+    Check if any point of an (N, 2) lon/lat array falls within bbox (WGS84)
 
-def coords_in_bbox(coords, bbox):
-    """Check if any coordinate falls within bbox (WGS84)"""
+    Tested in fixed-size chunks so dense shapes stop at the first chunk
+    with a point inside instead of comparing every vertex
+    """
     min_lat, max_lat, min_lon, max_lon = bbox
-    
-    def check_point(point):
-        if len(point) >= 2:
-            lon, lat = point[0], point[1]
-            return min_lon <= lon <= max_lon and min_lat <= lat <= max_lat
-        return False
-    
-    def check_nested(c):
-        if isinstance(c[0], (int, float)):
-            return check_point(c)
-        else:
-            return any(check_nested(sub) for sub in c)
-    
-    try:
-        return check_nested(coords)
-    except:
-        return True
+    for start in range(0, len(lonlat), chunk_size):
+        chunk = lonlat[start:start + chunk_size]
+        lon = chunk[:, 0]
+        lat = chunk[:, 1]
+        if ((lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)).any():
+            return True
+    return False
+
 
+def convert_shapefile_year(year, bbox=None, relevant_only=True, layers_info=None, max_workers=None):
+    """
+    Convert all relevant shapefiles for a given year
 
-def convert_shapefile_year(year, bbox=None, relevant_only=True):
-    """Convert all relevant shapefiles for a given year"""
+    Yields WGS84 features, already serialized to JSON bytes, layer by layer
+    instead of collecting them; a {"name", "feature_count"} entry is
+    appended to layers_info for each layer that produced features. Layers are converted by up to max_workers
+    processes (default: one per CPU)
+    """
     folder = YEAR_FOLDERS.get(year)
     if not folder:
         print(f"Unknown year: {year}")
-        return None
+        return
     
     folder_path = PLANIMETRICS_DIR / folder
     if not folder_path.exists():
         print(f"Folder not found: {folder_path}")
-        return None
+        return
     
     print(f"\n{'='*60}")
     print(f"Processing {year} data from {folder}")
     print('='*60)
     
-    all_features = []
-    layers_info = []
+    if layers_info is None:
+        layers_info = []
+    
+    # Project the query bbox once so shapes can be filtered in native coordinates
+    sp_bbox = bbox_to_state_plane(tuple(bbox)) if bbox else None
     
     relevant_layers = PEDESTRIAN_LAYERS.get(year, [])
+    relevant_lower = frozenset(l.lower() for l in relevant_layers)
     shp_files = list(folder_path.glob("*.shp"))
     
     print(f"Found {len(shp_files)} shapefiles")
     if relevant_only and relevant_layers:
         print(f"Processing only pedestrian-relevant layers: {relevant_layers}")
     
-    for shp_path in shp_files:
-        layer_name = shp_path.stem
-        
-        if relevant_only and relevant_layers:
-            if layer_name.lower() not in [l.lower() for l in relevant_layers]:
-                continue
-        
-        print(f"\n  Processing: {layer_name}")
-        
-        geojson = shapefile_to_geojson(shp_path, layer_name, year, bbox)
-        if geojson and geojson['features']:
-            all_features.extend(geojson['features'])
-            layers_info.append({
-                "name": layer_name,
-                "feature_count": len(geojson['features'])
-            })
-            print(f"    ✓ {len(geojson['features'])} features (transformed to WGS84)")
-        else:
-            print(f"    - No features in bbox or error")
+    shp_files = [
+        shp_path for shp_path in shp_files
+        if not (relevant_only and relevant_layers)
+        or shp_path.stem.lower() in relevant_lower
+    ]
+    if not shp_files:
+        return
+    
+    # Each shapefile has its own reader and features, so layers are converted
+    # in parallel. Every worker writes its layer's serialized features to its
+    # own file in a scratch directory; the parent streams those lines back in
+    # submission order, which keeps the output deterministic
+    max_workers = min(len(shp_files), max_workers or os.cpu_count() or 1)
+    with tempfile.TemporaryDirectory(prefix=f"planimetrics_{year}_") as scratch, \
+            ProcessPoolExecutor(max_workers=max_workers) as ex:
+        futures = [
+            ex.submit(shapefile_to_geojson, shp_path, shp_path.stem, year,
+                      Path(scratch) / f"{i}.geojsonl", bbox, sp_bbox)
+            for i, shp_path in enumerate(shp_files)
+        ]
+        for i, (shp_path, future) in enumerate(zip(shp_files, futures)):
+            layer_name = shp_path.stem
+            print(f"\n  Processing: {layer_name}")
+            
+            count = future.result()
+            if count:
+                layer_path = Path(scratch) / f"{i}.geojsonl"
+                with open(layer_path, 'rb') as f:
+                    for line in f:
+                        yield line.rstrip(b'\n')
+                layer_path.unlink()
+                layers_info.append({"name": layer_name, "feature_count": count})
+                print(f"    ✓ {count} features (transformed to WGS84)")
+            else:
+                print(f"    - No features in bbox or error")
+
+
+def save_flatgeobuf(geojson_path):
+    """
+    Write a FlatGeobuf copy of a GeoJSON file next to it
+
+    FlatGeobuf carries a packed spatial index and needs no JSON parsing, so
+    programmatic consumers can read it far faster than the GeoJSON, which is
+    kept for the frontend. Needs fiona; skipped when it is not installed.
+
+    Returns the .fgb path, or None if nothing was written
+    """
+    if fiona is None:
+        print("  fiona not installed, skipping FlatGeobuf output")
+        return None
     
-    combined = {
-        "type": "FeatureCollection",
-        "features": all_features,
-        "metadata": {
-            "source": "NYC Planimetrics Historical Data",
-            "year": year,
-            "layers": layers_info,
-            "total_features": len(all_features),
-            "crs": "EPSG:4326"
-        }
-    }
+    fgb_path = Path(geojson_path).with_suffix('.fgb')
+    try:
+        with fiona.open(str(geojson_path)) as src:
+            # FlatGeobuf has no date/time field types; keep them as ISO strings
+            schema = dict(src.schema)
+            schema['properties'] = {
+                k: 'str' if v.split(':')[0] in ('date', 'time', 'datetime') else v
+                for k, v in src.schema['properties'].items()
+            }
+            with fiona.open(str(fgb_path), 'w', driver='FlatGeobuf',
+                            crs=src.crs, schema=schema) as dst:
+                dst.writerecords(src)
+    except Exception as e:
+        print(f"  ✗ FlatGeobuf error: {e}")
+        return None
     
-    return combined
+    print(f"Saved: {fgb_path}")
+    return fgb_path
+
 
+def has_features(file_path):
+    """
+    Cheap non-emptiness check for a GeoJSON file written by an earlier run
 
-def save_geojson(data, output_path):
-    """Save GeoJSON data to file"""
-    with open(output_path, 'w') as f:
-        json.dump(data, f)
-    print(f"Saved: {output_path}")
+    Only the first few KB are read: an empty collection shows up as a bare
+    "features": [] near the start, so the file never needs a full parse
+    """
+    try:
+        if file_path.stat().st_size == 0:
+            return False
+        with open(file_path, 'rb') as f:
+            head = b''.join(f.read(4096).split())
+    except OSError:
+        return False
+    return b'"features":[' in head and b'"features":[]' not in head
 
 
-def create_reference_manifest():
-    """Create manifest file for reference data"""
+def create_reference_manifest(feature_counts=None):
+    """
+    Create manifest file for reference data
+
+    feature_counts maps year -> features written during this run; years not
+    in it fall back to a stat/head check of the existing file
+    """
+    feature_counts = feature_counts or {}
     manifest = {
         "name": "NYC Planimetrics Reference Data",
         "description": "Official NYC planimetrics data for validation (transformed to WGS84)",
         "available_years": [],
-        "files": {}
+        "files": {},
+        "flatgeobuf": {}
     }
     
     for year in [1996, 2004, 2014, 2022]:
         file_path = FRONTEND_DATA_DIR / f"planimetrics_{year}.geojson"
-        if file_path.exists():
-            try:
-                with open(file_path) as f:
-                    data = json.load(f)
-                    if data.get('features') and len(data['features']) > 0:
-                        manifest["available_years"].append(year)
-                        manifest["files"][str(year)] = f"reference/planimetrics_{year}.geojson"
-            except:
-                pass
+        if year in feature_counts:
+            available = feature_counts[year] > 0
+        else:
+            available = has_features(file_path)
+        if available:
+            manifest["available_years"].append(year)
+            manifest["files"][str(year)] = f"reference/planimetrics_{year}.geojson"
+            if file_path.with_suffix('.fgb').exists():
+                manifest["flatgeobuf"][str(year)] = f"reference/planimetrics_{year}.fgb"
     
     manifest_path = FRONTEND_DATA_DIR / "manifest.json"
-    with open(manifest_path, 'w') as f:
-        json.dump(manifest, f, indent=2)
+    manifest_path.write_bytes(dumps(manifest, indent=True))
     print(f"\nCreated manifest: {manifest_path}")
     
     return manifest
@@ -351,7 +442,34 @@ def create_reference_manifest():
 BROOKLYN_BBOX = [40.65, 40.70, -74.00, -73.95]
 
 
-def main():
+def convert_year(year, max_workers=None):
+    """Convert one year to GeoJSON (plus a FlatGeobuf copy) and return its feature count"""
+    metadata = {
+        "source": "NYC Planimetrics Historical Data",
+        "year": year,
+        "layers": [],
+        "crs": "EPSG:4326"
+    }
+    features = convert_shapefile_year(
+        year, bbox=BROOKLYN_BBOX, relevant_only=True,
+        layers_info=metadata["layers"], max_workers=max_workers
+    )
+    output_path = FRONTEND_DATA_DIR / f"planimetrics_{year}.geojson"
+    count = save_geojson(features, output_path, metadata)
+    if count:
+        print(f"Saved: {output_path}")
+        save_flatgeobuf(output_path)
+        print(f"  Total features for {year}: {count}")
+    else:
+        # Drop any output left by an earlier run, so the directory agrees
+        # with the manifest, which lists this year as unavailable
+        output_path.unlink(missing_ok=True)
+        output_path.with_suffix('.fgb').unlink(missing_ok=True)
+        print(f"  No features found for {year}")
+    return count
+
+
+def main(max_workers=None):
     print("Converting NYC Planimetrics Historical Data to GeoJSON")
     print("=" * 60)
     print("Transforming from EPSG:2263 (NY State Plane) to EPSG:4326 (WGS84)")
@@ -366,16 +484,14 @@ def main():
     
     years_to_process = [1996, 2004]
     
-    for year in years_to_process:
-        data = convert_shapefile_year(year, bbox=BROOKLYN_BBOX, relevant_only=True)
-        if data and data['features']:
-            output_path = FRONTEND_DATA_DIR / f"planimetrics_{year}.geojson"
-            save_geojson(data, output_path)
-            print(f"  Total features for {year}: {len(data['features'])}")
-        else:
-            print(f"  No features found for {year}")
+    # Parallelism is at the layer level only: years run one after another
+    # in this process, each with its own layer pool of up to max_workers, so
+    # pools are never nested and the bbox_to_state_plane cache is shared
+    feature_counts = {
+        year: convert_year(year, max_workers=max_workers) for year in years_to_process
+    }
     
-    create_reference_manifest()
+    create_reference_manifest(feature_counts)
     
     print("\n" + "=" * 60)
     print("Conversion complete!")
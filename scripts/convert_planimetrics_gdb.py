@@ -1,12 +1,26 @@
 """
 Convert NYC Planimetrics 2014 and 2022 File Geodatabase data to GeoJSON
-Uses Fiona to read ESRI File Geodatabase format
+Uses pyogrio (or Fiona when it is missing) to read ESRI File Geodatabase format
 """
-import json
+import contextlib
 import math
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 import fiona
-from fiona.transform import transform_geom
+import numpy as np
+import shapely
+from fiona.transform import transform, transform_geom
+
+from geojson_common import dumps, save_geojson, stringify
+
+try:
+    import pyarrow as pa
+    import pyogrio
+    from pyproj import Transformer
+except ImportError:
+    pyogrio = None
 
 # Paths
 PLANIMETRICS_DIR = Path("NYC_Planimetrics_Historical_Data")
@@ -21,133 +35,368 @@ YEAR_FOLDERS = {
     2022: "NYC_Planimetrics_2022.gdb"
 }
 
+# Decimal places kept for reprojected lon/lat (~11 cm at NYC's latitude)
+COORD_PRECISION = 6
+
+# Relevant layers for pedestrian infrastructure, matched anywhere in the
+# layer name (case-insensitive)
+RELEVANT_LAYER_RE = re.compile(
+    r'sidewalk|crosswalk|pedestrian|curb|centerline|street|plaza|median|'
+    r'path|walkway|pavement',
+    re.IGNORECASE
+)
+
+# Layers with more features than this are queried as four quadrant
+# sub-queries in parallel instead of one envelope query
+QUADRANT_SPLIT_FEATURES = 200000
+
 # Brooklyn bounding box for filtering (approximate)
 # [min_lon, min_lat, max_lon, max_lat]
 BROOKLYN_BBOX = [-74.05, 40.57, -73.83, 40.74]
 
-def coords_in_bbox(geometry, bbox):
-    """Check if geometry intersects with bbox"""
-    min_lon, min_lat, max_lon, max_lat = bbox
-    
-    def check_coord(coord):
-        if len(coord) >= 2:
-            lon, lat = coord[0], coord[1]
-            return min_lon <= lon <= max_lon and min_lat <= lat <= max_lat
-        return False
-    
-    def check_coords(coords):
-        if not coords:
-            return False
-        if isinstance(coords[0], (int, float)):
-            return check_coord(coords)
-        return any(check_coords(c) for c in coords)
-    
-    try:
-        geom_type = geometry.get('type', '')
-        coords = geometry.get('coordinates', [])
+@lru_cache(maxsize=None)
+def bbox_area(bbox):
+    """
+    Prepared shapely box for a (min_lon, min_lat, max_lon, max_lat) tuple
+
+    Preparing builds GEOS's spatial index on the box once, so every
+    intersects() test against it afterwards is a cheap indexed lookup
+    """
+    area = shapely.box(*bbox)
+    shapely.prepare(area)
+    return area
+
+def intersects_bbox(geoms, bbox):
+    """Boolean mask of the shapely geometries that intersect bbox (WGS84)"""
+    return shapely.intersects(bbox_area(tuple(bbox)), geoms)
+
+@lru_cache(maxsize=32)
+def transform_envelope(bounds, src_crs, dst_crs, densify_pts=21):
+    """
+    Envelope in dst_crs of a (minx, miny, maxx, maxy) box given in src_crs
+
+    Edges are densified before taking the envelope, since straight edges in
+    one CRS become arcs in the other and the corners alone would clip them.
+    Cached, since every layer of a geodatabase shares the same CRS.
+    """
+    minx, miny, maxx, maxy = bounds
+    steps = [i / (densify_pts + 1) for i in range(densify_pts + 2)]
+    xs_edge = [minx + (maxx - minx) * t for t in steps]
+    ys_edge = [miny + (maxy - miny) * t for t in steps]
+    xs = xs_edge + xs_edge + [minx] * len(ys_edge) + [maxx] * len(ys_edge)
+    ys = [miny] * len(xs_edge) + [maxy] * len(xs_edge) + ys_edge + ys_edge
+    xs, ys = transform(src_crs, dst_crs, xs, ys)
+    return (min(xs), min(ys), max(xs), max(ys))
+
+def bbox_to_crs(bbox, dst_crs):
+    """
+    Envelope of a WGS84 bbox in dst_crs, for OGR's spatial filter
+
+    Input: (min_lon, min_lat, max_lon, max_lat) tuple and a CRS string
+    Output: (minx, miny, maxx, maxy) in dst_crs units
+    """
+    return transform_envelope(bbox, 'EPSG:4326', dst_crs)
+
+def bbox_relation(layer_bounds, src_crs, bbox):
+    """
+    How a layer's extent relates to a WGS84 bbox
+
+    Returns 'disjoint' when no feature can touch the bbox, 'inside' when
+    every feature lies within it, and 'partial' otherwise (or when the
+    layer reports no usable bounds)
+    """
+    if not layer_bounds or not all(math.isfinite(v) for v in layer_bounds):
+        return 'partial'
+    
+    minx, miny, maxx, maxy = layer_bounds
+    qminx, qminy, qmaxx, qmaxy = bbox_to_crs(tuple(bbox), src_crs)
+    if maxx < qminx or minx > qmaxx or maxy < qminy or miny > qmaxy:
+        return 'disjoint'
+    
+    min_lon, min_lat, max_lon, max_lat = transform_envelope(tuple(layer_bounds), src_crs, 'EPSG:4326')
+    if min_lon >= bbox[0] and min_lat >= bbox[1] and max_lon <= bbox[2] and max_lat <= bbox[3]:
+        return 'inside'
+    return 'partial'
+
+# Fiona records reprojected per transform call
+FIONA_BATCH_SIZE = 10000
+
+def map_coords(coords, fn):
+    """Apply fn to every position of a GeoJSON coordinate array, keeping its nesting"""
+    if not coords:
+        return coords
+    if isinstance(coords[0], (int, float)):
+        return fn(coords)
+    return [map_coords(c, fn) for c in coords]
+
+def geometry_dict(geom):
+    """Plain-dict copy of a Fiona Geometry, members of GeometryCollections included"""
+    if geom['type'] == 'GeometryCollection':
+        return {"type": geom['type'], "geometries": [geometry_dict(g) for g in geom['geometries']]}
+    return {"type": geom['type'], "coordinates": geom['coordinates']}
+
+def project_geometries(geoms, src_crs):
+    """
+    Reproject a batch of GeoJSON geometries to WGS84 with one transform call
+
+    Positions are gathered into flat x/y lists, projected together and then
+    written back in the same walk order, rounded to COORD_PRECISION places;
+    Z values are carried over as is
+    """
+    points = []
+    for geom in geoms:
+        if 'coordinates' in geom:
+            map_coords(geom['coordinates'], points.append)
+    if not points:
+        return [geometry_dict(transform_geom(src_crs, 'EPSG:4326', geom)) for geom in geoms]
+    
+    lons, lats = transform(src_crs, 'EPSG:4326', [p[0] for p in points], [p[1] for p in points])
+    projected = iter(zip(lons, lats, points))
+    
+    def rebuild(_):
+        lon, lat, point = next(projected)
+        return [round(lon, COORD_PRECISION), round(lat, COORD_PRECISION), *point[2:]]
+    
+    out = []
+    for geom in geoms:
+        if 'coordinates' in geom:
+            out.append({"type": geom['type'], "coordinates": map_coords(geom['coordinates'], rebuild)})
+        else:
+            # GeometryCollections have no coordinates array of their own
+            out.append(geometry_dict(transform_geom(src_crs, 'EPSG:4326', geom)))
+    return out
+
+# Fiona field types whose values already come back as JSON-native Python
+# values (Fiona returns dates and times as ISO strings)
+JSON_SAFE_FIONA_TYPES = {'str', 'int', 'int32', 'int64', 'float', 'bool', 'date', 'time', 'datetime'}
+
+def string_columns_fiona(schema):
+    """Names of the columns in a Fiona schema whose values need str()"""
+    return [
+        name for name, field_type in schema['properties'].items()
+        if field_type.split(':')[0] not in JSON_SAFE_FIONA_TYPES
+    ]
+
+def string_columns_arrow(schema):
+    """Names of the columns in an Arrow schema whose values need str()"""
+    return [
+        field.name for field in schema
+        if not (pa.types.is_string(field.type) or pa.types.is_large_string(field.type)
+                or pa.types.is_integer(field.type) or pa.types.is_floating(field.type)
+                or pa.types.is_boolean(field.type) or pa.types.is_null(field.type))
+    ]
+
+def read_layer_fiona(gdb_path, layer_name, bbox=None):
+    """Yield (WGS84 geometry, JSON-safe properties) for a layer, reprojecting Fiona records in batches"""
+    with fiona.open(str(gdb_path), layer=layer_name) as src:
+        # Get source CRS
+        src_crs = src.crs
+        needs_transform = src_crs and str(src_crs).upper() != 'EPSG:4326'
+        str_columns = string_columns_fiona(src.schema)
+        
+        # Layers entirely outside the bbox are skipped, and layers entirely
+        # inside it need no spatial filtering at all
+        if bbox and src_crs:
+            relation = bbox_relation(src.bounds, str(src_crs), bbox)
+            if relation == 'disjoint':
+                return
+            if relation == 'inside':
+                bbox = None
+        
+        # Let OGR drop features whose envelope misses the bbox before
+        # they are turned into Python objects and reprojected
+        features = src
+        if bbox and src_crs:
+            features = src.filter(bbox=bbox_to_crs(tuple(bbox), str(src_crs)))
         
-        if geom_type == 'Point':
-            return check_coord(coords)
-        elif geom_type in ('LineString', 'MultiPoint'):
-            return any(check_coord(c) for c in coords)
-        elif geom_type in ('Polygon', 'MultiLineString'):
-            return any(any(check_coord(c) for c in ring) for ring in coords)
-        elif geom_type == 'MultiPolygon':
-            return any(any(any(check_coord(c) for c in ring) for ring in poly) for poly in coords)
-        return True
-    except:
-        return True
-
-def convert_gdb_year(year, bbox=None):
-    """Convert File Geodatabase for a given year"""
+        batch = []
+        for feature in features:
+            geom = feature.geometry
+            if geom is None:
+                continue
+            
+            # Fiona >= 1.9 Geometry objects expose a plain dict here
+            props = stringify(dict(feature.properties), str_columns)
+            batch.append((geom.__geo_interface__, props))
+            if len(batch) >= FIONA_BATCH_SIZE:
+                yield from _project_batch(batch, src_crs, needs_transform, bbox)
+                batch = []
+        
+        if batch:
+            yield from _project_batch(batch, src_crs, needs_transform, bbox)
+
+def _project_batch(batch, src_crs, needs_transform, bbox=None):
+    """Transform a batch of (geometry, properties) pairs from source CRS to WGS84"""
+    if needs_transform:
+        geoms = project_geometries([geom for geom, _ in batch], src_crs)
+        batch = [(geom, props) for geom, (_, props) in zip(geoms, batch)]
+    # OGR only compared envelopes; keep what really intersects the bbox
+    if bbox:
+        keep = intersects_bbox([shapely.geometry.shape(geom) for geom, _ in batch], bbox)
+        batch = [pair for pair, k in zip(batch, keep) if k]
+    return batch
+
+@lru_cache(maxsize=32)
+def wgs84_transformer(src_crs):
+    """pyproj Transformer from src_crs to WGS84, built once per CRS"""
+    return Transformer.from_crs(src_crs, 'EPSG:4326', always_xy=True)
+
+def read_arrow_quadrants(gdb_path, layer_name, query):
+    """
+    Read an envelope query as four quadrant sub-queries in parallel threads
+
+    GDAL releases the GIL while it walks the layer's spatial index, so the
+    quadrants are scanned concurrently. Features whose envelopes straddle a
+    quadrant edge come back more than once and are deduplicated by FID; the
+    merged table is in FID order, like a single sequential read.
+    """
+    minx, miny, maxx, maxy = query
+    midx = (minx + maxx) / 2
+    midy = (miny + maxy) / 2
+    quadrants = [
+        (minx, miny, midx, midy), (midx, miny, maxx, midy),
+        (minx, midy, midx, maxy), (midx, midy, maxx, maxy),
+    ]
+    
+    def read(quadrant):
+        return pyogrio.read_arrow(
+            str(gdb_path), layer=layer_name, bbox=quadrant,
+            datetime_as_string=True, return_fids=True
+        )
+    
+    with ThreadPoolExecutor(max_workers=len(quadrants)) as ex:
+        results = list(ex.map(read, quadrants))
+    
+    meta = results[0][0]
+    fid_column = meta['fid_column'] or '__fid'
+    table = pa.concat_tables([table for _, table in results])
+    _, first = np.unique(table.column(fid_column).to_numpy(), return_index=True)
+    return meta, table.take(first).drop_columns([fid_column])
+
+def read_layer_pyogrio(gdb_path, layer_name, bbox=None):
+    """
+    Yield (WGS84 geometry, JSON-safe properties) for a layer read with pyogrio
+
+    GDAL hands back the bbox-filtered layer as an Arrow table; geometries are
+    decoded and reprojected as whole arrays instead of feature by feature
+    """
+    info = pyogrio.read_info(str(gdb_path), layer=layer_name, force_total_bounds=True)
+    src_crs = info['crs']
+    
+    # Layers entirely outside the bbox are skipped, and layers entirely
+    # inside it need no spatial filtering at all
+    if bbox and src_crs:
+        relation = bbox_relation(info['total_bounds'], src_crs, bbox)
+        if relation == 'disjoint':
+            return
+        if relation == 'inside':
+            bbox = None
+    
+    query = bbox_to_crs(tuple(bbox), src_crs) if bbox and src_crs else None
+    if query and info['features'] > QUADRANT_SPLIT_FEATURES:
+        meta, table = read_arrow_quadrants(gdb_path, layer_name, query)
+    else:
+        meta, table = pyogrio.read_arrow(
+            str(gdb_path), layer=layer_name, bbox=query, datetime_as_string=True
+        )
+    
+    geom_column = meta['geometry_name'] or 'wkb_geometry'
+    geoms = shapely.from_wkb(table.column(geom_column).to_numpy(zero_copy_only=False))
+    table = table.drop_columns([geom_column])
+    str_columns = string_columns_arrow(table.schema)
+    records = table.to_pylist()
+    
+    # Transform from source CRS to WGS84 (rounded to COORD_PRECISION places),
+    # keeping any Z values as they are
+    if src_crs and src_crs.upper() != 'EPSG:4326':
+        to_wgs84 = wgs84_transformer(src_crs)
+        
+        def project(coords):
+            out = coords.copy()
+            lon, lat = to_wgs84.transform(coords[:, 0], coords[:, 1])
+            out[:, 0] = np.round(lon, COORD_PRECISION)
+            out[:, 1] = np.round(lat, COORD_PRECISION)
+            return out
+        
+        # 2D and 3D geometries are transformed apart, so a mixed layer
+        # doesn't give its 2D geometries a NaN z
+        has_z = shapely.has_z(geoms)
+        geoms[has_z] = shapely.transform(geoms[has_z], project, include_z=True)
+        geoms[~has_z] = shapely.transform(geoms[~has_z], project)
+    
+    # OGR only compared envelopes; keep what really intersects the bbox,
+    # tested for the whole layer in one vectorized GEOS call
+    keep = ~shapely.is_missing(geoms)
+    if bbox:
+        keep &= intersects_bbox(geoms, bbox)
+    
+    for i in np.flatnonzero(keep):
+        yield shapely.geometry.mapping(geoms[i]), stringify(records[i], str_columns)
+
+# Prefer pyogrio's bulk Arrow reader; plain Fiona iteration is the fallback
+read_layer = read_layer_pyogrio if pyogrio is not None else read_layer_fiona
+
+def convert_gdb_year(year, bbox=None, layers_info=None):
+    """
+    Convert File Geodatabase for a given year
+
+    Yields WGS84 features layer by layer instead of collecting them; a
+    {"name", "feature_count"} entry is appended to layers_info for each layer
+    that produced features
+    """
     folder = YEAR_FOLDERS.get(year)
     if not folder:
         print(f"Unknown year: {year}")
-        return None
+        return
     
     gdb_path = PLANIMETRICS_DIR / folder
     if not gdb_path.exists():
         print(f"GDB not found: {gdb_path}")
-        return None
+        return
     
     print(f"\n{'='*60}")
     print(f"Processing {year} data from {folder}")
     print('='*60)
     
     # List available layers
-    layers = fiona.listlayers(str(gdb_path))
+    if pyogrio is not None:
+        layers = list(pyogrio.list_layers(str(gdb_path))[:, 0])
+    else:
+        layers = fiona.listlayers(str(gdb_path))
     print(f"Found {len(layers)} layers")
     
-    # Relevant layers for pedestrian infrastructure
-    relevant_keywords = [
-        'sidewalk', 'crosswalk', 'pedestrian', 'curb', 
-        'centerline', 'street', 'plaza', 'median',
-        'path', 'walkway', 'pavement'
-    ]
-    
-    all_features = []
-    layers_info = []
+    if layers_info is None:
+        layers_info = []
     
-    for layer_name in layers:
-        # Check if layer name contains relevant keywords
-        layer_lower = layer_name.lower()
-        is_relevant = any(kw in layer_lower for kw in relevant_keywords)
-        
-        if not is_relevant:
-            continue
-        
-        print(f"\n  Processing: {layer_name}")
-        
-        try:
-            with fiona.open(str(gdb_path), layer=layer_name) as src:
-                # Get source CRS
-                src_crs = src.crs
+    # On the Fiona path, one GDAL/PROJ environment for all of the year's
+    # layers lets CRS lookups made for the first layer be reused by the
+    # rest; pyogrio bundles its own GDAL, which a fiona.Env doesn't reach
+    with fiona.Env() if pyogrio is None else contextlib.nullcontext():
+        for layer_name in layers:
+            # Check if layer name contains relevant keywords
+            if not RELEVANT_LAYER_RE.search(layer_name):
+                continue
+            
+            print(f"\n  Processing: {layer_name}")
+            
+            try:
                 feature_count = 0
                 
-                for feature in src:
-                    # Transform geometry to WGS84 if needed
-                    geom = feature['geometry']
-                    if geom is None:
-                        continue
-                    
-                    # Convert fiona geometry to dict if needed
-                    if hasattr(geom, '__geo_interface__'):
-                        geom = dict(geom)
-                    elif not isinstance(geom, dict):
-                        geom = dict(geom)
-                    
-                    # Transform from source CRS to WGS84
-                    if src_crs and str(src_crs).upper() != 'EPSG:4326':
-                        try:
-                            geom = transform_geom(src_crs, 'EPSG:4326', geom)
-                            # Ensure result is a dict
-                            if hasattr(geom, '__geo_interface__'):
-                                geom = dict(geom)
-                        except Exception as e:
-                            continue
-                    
-                    # Filter by bbox if provided
-                    if bbox and not coords_in_bbox(geom, bbox):
-                        continue
-                    
-                    # Clean properties
-                    props = {}
-                    for k, v in feature['properties'].items():
-                        if isinstance(v, (int, float, str, bool, type(None))):
-                            props[k] = v
-                        else:
-                            props[k] = str(v)
+                for geom, properties in read_layer(gdb_path, layer_name, bbox):
+                    # Readers return JSON-safe values, converted per column
+                    # from the layer schema
+                    props = properties
                     
                     # Add metadata
                     props['_source_layer'] = layer_name
                     props['_source_year'] = year
                     props['_source'] = 'NYC_Planimetrics'
                     
-                    all_features.append({
+                    yield {
                         "type": "Feature",
                         "geometry": geom,
                         "properties": props
-                    })
+                    }
                     feature_count += 1
                 
                 if feature_count > 0:
@@ -159,28 +408,8 @@ def convert_gdb_year(year, bbox=None):
                 else:
                     print(f"    - No features in bbox")
                     
-        except Exception as e:
-            print(f"    ✗ Error: {e}")
-    
-    # Create combined GeoJSON
-    combined = {
-        "type": "FeatureCollection",
-        "features": all_features,
-        "metadata": {
-            "source": "NYC Planimetrics Historical Data",
-            "year": year,
-            "layers": layers_info,
-            "total_features": len(all_features)
-        }
-    }
-    
-    return combined
-
-def save_geojson(data, output_path):
-    """Save GeoJSON data to file"""
-    with open(output_path, 'w') as f:
-        json.dump(data, f)
-    print(f"Saved: {output_path}")
+            except Exception as e:
+                print(f"    ✗ Error: {e}")
 
 def update_manifest():
     """Update manifest file with all available years"""
@@ -188,7 +417,8 @@ def update_manifest():
         "name": "NYC Planimetrics Reference Data",
         "description": "Official NYC planimetrics data for validation",
         "available_years": [],
-        "files": {}
+        "files": {},
+        "flatgeobuf": {}
     }
     
     for year in [1996, 2004, 2014, 2022]:
@@ -196,25 +426,45 @@ def update_manifest():
         if file_path.exists():
             manifest["available_years"].append(year)
             manifest["files"][str(year)] = f"reference/planimetrics_{year}.geojson"
+            # FlatGeobuf copies written by convert_planimetrics.py
+            if file_path.with_suffix('.fgb').exists():
+                manifest["flatgeobuf"][str(year)] = f"reference/planimetrics_{year}.fgb"
     
     manifest_path = FRONTEND_DATA_DIR / "manifest.json"
-    with open(manifest_path, 'w') as f:
-        json.dump(manifest, f, indent=2)
+    manifest_path.write_bytes(dumps(manifest, indent=True))
     print(f"\nUpdated manifest: {manifest_path}")
     print(f"Available years: {manifest['available_years']}")
 
+def convert_year(year):
+    """Convert one year's geodatabase to GeoJSON and return its feature count"""
+    metadata = {
+        "source": "NYC Planimetrics Historical Data",
+        "year": year,
+        "layers": []
+    }
+    features = convert_gdb_year(year, bbox=BROOKLYN_BBOX, layers_info=metadata["layers"])
+    output_path = FRONTEND_DATA_DIR / f"planimetrics_{year}.geojson"
+    count = save_geojson(features, output_path, metadata)
+    if count:
+        print(f"Saved: {output_path}")
+        print(f"  Total features for {year}: {count}")
+    else:
+        # update_manifest goes by the files on disk, so an empty year must
+        # not leave a file behind (nor keep one from an earlier run)
+        output_path.unlink(missing_ok=True)
+        print(f"  No features extracted for {year}")
+    return count
+
 def main():
     print("Converting NYC Planimetrics 2014 & 2022 (File Geodatabase) to GeoJSON")
     print("=" * 60)
     
-    for year in [2014, 2022]:
-        data = convert_gdb_year(year, bbox=BROOKLYN_BBOX)
-        if data and data['features']:
-            output_path = FRONTEND_DATA_DIR / f"planimetrics_{year}.geojson"
-            save_geojson(data, output_path)
-            print(f"  Total features for {year}: {len(data['features'])}")
-        else:
-            print(f"  No features extracted for {year}")
+    years = [2014, 2022]
+    
+    # Each year reads its own geodatabase and writes its own file, so the
+    # years are converted in separate processes
+    with ProcessPoolExecutor(max_workers=len(years)) as ex:
+        list(ex.map(convert_year, years))
     
     # Update manifest
     update_manifest()
@@ -1,68 +1,202 @@
 """
 Convert tile2net shapefiles to GeoJSON for the frontend app
-Uses pyshp library for shapefile reading
+Uses pyogrio for shapefile reading, or the pyshp library when it is missing
+
+Output with pyogrio matches pyshp's except for one thing: GDAL's dbf reader
+trims leading spaces from text fields, so a value stored as " abc" comes
+out as "abc" (pyshp keeps the leading spaces)
 
 Updated to support bk_central_YYYY folder structure from new tile2net runs
+
+Usage:
+    python convert_shapefiles.py              # every bk_central_YYYY folder
+    python convert_shapefiles.py 2018 2022    # only the given years
+
+The manifest lists the years converted in the run
 """
-import json
+import argparse
+import contextlib
+import functools
 import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import numpy as np
 import shapefile
 
+from geojson_common import dumps, save_geojson, stringify
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyogrio
+    import shapely
+except ImportError:
+    pyogrio = None
+
+# Number of records read and decoded per batch
+RECORD_BATCH_SIZE = 50_000
+
+# Number of network vertices buffered before they are folded into the stats
+VERTEX_BATCH_SIZE = 65_536
+
 # Paths
 OUTPUT_DIR = Path("output")
+YEAR_DIR_RE = re.compile(r"bk_central_(\d{4})")
 FRONTEND_DATA_DIR = Path("frontend/public/data")
 
 # Create output directory
 FRONTEND_DATA_DIR.mkdir(parents=True, exist_ok=True)
 
-def shapefile_to_geojson(shp_path):
-    """Convert a shapefile to GeoJSON format"""
-    sf = shapefile.Reader(str(shp_path))
-    
-    features = []
-    fields = [field[0] for field in sf.fields[1:]]  # Skip DeletionFlag
-    
-    for sr in sf.shapeRecords():
-        # Get geometry
-        geom = sr.shape.__geo_interface__
-        
-        # Get properties
-        props = dict(zip(fields, sr.record))
+def correct_logicals(sf, batch, rows, fid_column, columns):
+    """
+    Replace the given logical columns of the rows GDAL may have misread
+
+    GDAL reads an unset logical (blank) as False where pyshp gives None. Only
+    rows holding a False can be affected; they are picked out of the Arrow
+    columns and re-read from the dbf by FID, which for a shapefile is the
+    record number, so the two readers stay aligned record for record
+    """
+    suspect = functools.reduce(pc.or_, [pc.fill_null(pc.invert(batch.column(name)), False)
+                                        for name in columns])
+    fids = batch.column(fid_column)
+    for i in np.flatnonzero(suspect.to_numpy(zero_copy_only=False)).tolist():
+        rows[i].update(sf.record(fids[i].as_py(), fields=columns).as_dict())
+
+def read_features_pyogrio(shp_path):
+    """
+    Yield (geometry, JSON-safe properties) pairs read with pyogrio
+
+    GDAL streams the file as Arrow record batches of RECORD_BATCH_SIZE rows;
+    geometries are parsed from WKB one batch at a time and attributes come
+    back as typed columns, so nothing is decoded record by record in Python
+    and only one batch is held in memory
+    """
+    with pyogrio.open_arrow(str(shp_path), datetime_as_string=True, use_pyarrow=True,
+                            batch_size=RECORD_BATCH_SIZE, return_fids=True) as (meta, reader):
+        geom_column = meta['geometry_name'] or 'wkb_geometry'
+        fid_column = meta['fid_column']
         
-        # Clean up properties (convert to JSON-serializable types)
-        clean_props = {}
-        for k, v in props.items():
-            if isinstance(v, (int, float, str, bool, type(None))):
-                clean_props[k] = v
-            else:
-                clean_props[k] = str(v)
+        # Strings, numbers and booleans are already JSON-native; anything else
+        # is converted with str(), decided once per column from the schema
+        str_columns = [
+            field.name for field in reader.schema
+            if field.name not in (geom_column, fid_column)
+            and not (pa.types.is_string(field.type) or pa.types.is_integer(field.type)
+                     or pa.types.is_floating(field.type) or pa.types.is_boolean(field.type)
+                     or pa.types.is_null(field.type))
+        ]
+        # dbf text can't be null; GDAL reports blank text as null, pyshp as ''
+        text_columns = [
+            field.name for field in reader.schema
+            if pa.types.is_string(field.type) or pa.types.is_large_string(field.type)
+        ]
+        bool_columns = [field.name for field in reader.schema if pa.types.is_boolean(field.type)]
         
-        feature = {
+        with shapefile.Reader(str(shp_path)) if bool_columns else contextlib.nullcontext() as sf:
+            for batch in reader:
+                geoms = shapely.from_wkb(batch.column(geom_column).to_numpy(zero_copy_only=False))
+                rows = batch.drop_columns([geom_column, fid_column]).to_pylist()
+                if bool_columns:
+                    correct_logicals(sf, batch, rows, fid_column, bool_columns)
+                for geom, props in zip(geoms, rows):
+                    geometry = shapely.geometry.mapping(geom) if geom is not None else None
+                    for name in text_columns:
+                        if props[name] is None:
+                            props[name] = ''
+                    yield geometry, stringify(props, str_columns)
+
+def read_features_pyshp(shp_path):
+    """Yield (geometry, JSON-safe properties) pairs read with pyshp"""
+    with shapefile.Reader(str(shp_path)) as sf:
+        fields = [field[0] for field in sf.fields[1:]]  # Skip DeletionFlag
+        # Character, numeric, float and logical values are JSON-native;
+        # dates (and other types) are converted with str()
+        str_columns = [field[0] for field in sf.fields[1:] if field[1] not in ('C', 'N', 'F', 'L')]
+        for sr in sf.iterShapeRecords():
+            props = stringify(dict(zip(fields, sr.record)), str_columns)
+            yield sr.shape.__geo_interface__, props
+
+# Prefer pyogrio's C reader; pyshp is the pure-Python fallback
+read_features = read_features_pyogrio if pyogrio is not None else read_features_pyshp
+
+def shapefile_to_geojson(shp_path, year=None):
+    """
+    Yield the features of a shapefile as GeoJSON Feature dicts
+
+    Features are produced one at a time as the reader goes, so a whole
+    FeatureCollection is never held in memory; the year property (when
+    given) is set while building each feature
+    """
+    for geom, props in read_features(shp_path):
+        if year is not None:
+            props['year'] = year
+        yield {
             "type": "Feature",
             "geometry": geom,
-            "properties": clean_props
+            "properties": props
         }
-        features.append(feature)
-    
-    return {
-        "type": "FeatureCollection",
-        "features": features
-    }
+
+def line_coords(geom):
+    """Stack the vertices of a LineString/MultiLineString into one (N, 2) array"""
+    if not geom or not len(geom['coordinates']):
+        return None
+    if geom['type'] == 'LineString':
+        lines = [geom['coordinates']]
+    elif geom['type'] == 'MultiLineString':
+        lines = [line for line in geom['coordinates'] if len(line)]
+    else:
+        return None
+    if not lines:
+        return None
+    return np.concatenate([np.asarray(line, dtype=np.float64)[:, :2] for line in lines])
+
+def add_vertices(stats, xy):
+    """Add an (N, 2) vertex array to stats (running sum, count, min and max)"""
+    stats['sum'] += xy.sum(axis=0)
+    stats['count'] += len(xy)
+    stats['min'] = np.minimum(stats['min'], xy.min(axis=0))
+    stats['max'] = np.maximum(stats['max'], xy.max(axis=0))
+
+def track_vertices(features, stats):
+    """
+    Pass features through unchanged while adding their line vertices to
+    stats, so the map center can be computed without keeping the features
+    around
+
+    Vertex arrays are buffered and reduced VERTEX_BATCH_SIZE at a time, so
+    the sum/min/max run over large arrays instead of once per feature
+    """
+    pending, pending_count = [], 0
+    for feature in features:
+        xy = line_coords(feature['geometry'])
+        if xy is not None:
+            pending.append(xy)
+            pending_count += len(xy)
+            if pending_count >= VERTEX_BATCH_SIZE:
+                add_vertices(stats, np.concatenate(pending))
+                pending, pending_count = [], 0
+        yield feature
+    if pending:
+        add_vertices(stats, np.concatenate(pending))
 
 def find_shapefile_in_dir(base_dir):
     """Find the first shapefile in a directory (handles nested timestamped folders)"""
-    if not base_dir.exists():
-        return None
-    
     # Look for .shp files directly or in subdirectories
-    for item in base_dir.iterdir():
-        if item.is_dir():
-            shp_files = list(item.glob("*.shp"))
-            if shp_files:
-                return shp_files[0]
-        elif item.suffix == '.shp':
-            return item
+    # Stop at the first match; os.scandir entries carry their type, so no
+    # extra stat() or Path object is needed per entry
+    try:
+        with os.scandir(base_dir) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    with os.scandir(entry.path) as sub_entries:
+                        for sub_entry in sub_entries:
+                            if sub_entry.name.endswith('.shp') and not sub_entry.is_dir():
+                                return Path(sub_entry.path)
+                elif entry.name.endswith('.shp'):
+                    return Path(entry.path)
+    except FileNotFoundError:
+        pass
     
     return None
 
@@ -70,38 +204,58 @@ def discover_years():
     """Discover available years from the output folder"""
     years = []
     
-    for folder in OUTPUT_DIR.iterdir():
-        if folder.is_dir() and folder.name.startswith("bk_central_"):
-            try:
-                year = int(folder.name.split("_")[-1])
-                years.append(year)
-            except ValueError:
-                continue
+    with os.scandir(OUTPUT_DIR) as entries:
+        for entry in entries:
+            match = YEAR_DIR_RE.fullmatch(entry.name)
+            if match and entry.is_dir():
+                years.append(int(match.group(1)))
     
     return sorted(years)
 
-# Discover years from output folder
-years = discover_years()
+def requested_years(years):
+    """
+    Keep the years given on the command line whose folder exists
 
-if not years:
-    print("No bk_central_YYYY folders found in output/")
-    exit(1)
+    Only the named output/bk_central_YYYY folders are checked, so a
+    pinpoint run does not scan the whole output folder
+    """
+    return sorted(
+        year for year in set(years)
+        if (OUTPUT_DIR / f"bk_central_{year}").is_dir()
+    )
 
-print("Converting tile2net shapefiles to GeoJSON...")
-print("=" * 50)
-print(f"Found years: {years}")
+def new_vertex_stats():
+    """Empty running vertex sum/count and extent"""
+    return {
+        "sum": np.zeros(2),
+        "count": 0,
+        "min": np.full(2, np.inf),
+        "max": np.full(2, -np.inf)
+    }
+
+def merge_vertex_stats(total, stats):
+    """Fold one year's vertex statistics into the running total, in place"""
+    total["sum"] += stats["sum"]
+    total["count"] += stats["count"]
+    total["min"] = np.minimum(total["min"], stats["min"])
+    total["max"] = np.maximum(total["max"], stats["max"])
 
-# Track successful conversions
-converted_years = []
-location_info = None
+def convert_year(year):
+    """
+    Convert one year's network and polygon shapefiles
 
-for year in years:
+    Returns (year, converted, vertex_stats) so the parent process can build
+    the manifest; every year reads and writes its own files, so years can
+    run in separate processes
+    """
+    vertex_stats = new_vertex_stats()
+    
     # New folder structure: output/bk_central_YYYY/bk_central_YYYY/
     year_dir = OUTPUT_DIR / f"bk_central_{year}" / f"bk_central_{year}"
     
     if not year_dir.exists():
         print(f"\n[{year}] Directory not found: {year_dir}")
-        continue
+        return year, False, vertex_stats
     
     network_converted = False
     polygon_converted = False
@@ -114,35 +268,19 @@ for year in years:
         print(f"\n[{year}] Processing network: {shp_path.name}")
         
         try:
-            geojson = shapefile_to_geojson(shp_path)
-            
-            # Add year to each feature
-            for feature in geojson['features']:
-                feature['properties']['year'] = year
+            # Vertex statistics for map centering are gathered while streaming
+            features = track_vertices(shapefile_to_geojson(shp_path, year), vertex_stats)
             
             output_file = FRONTEND_DATA_DIR / f"network_{year}.geojson"
-            with open(output_file, 'w') as f:
-                json.dump(geojson, f)
+            seq_file = FRONTEND_DATA_DIR / f"network_{year}.geojsonl"
+            count = save_geojson(features, output_file, seq_path=seq_file)
             
-            print(f"  ✓ Saved: {output_file.name}")
-            print(f"    Features: {len(geojson['features'])}")
+            print(f"  ✓ [{year}] Saved: {output_file.name}, {seq_file.name}")
+            print(f"    Features: {count}")
             network_converted = True
             
-            # Extract location info from first feature for map centering
-            if location_info is None and geojson['features']:
-                first_geom = geojson['features'][0]['geometry']
-                if first_geom['type'] == 'LineString' and first_geom['coordinates']:
-                    coords = first_geom['coordinates']
-                    # Calculate center from all coordinates
-                    lons = [c[0] for c in coords]
-                    lats = [c[1] for c in coords]
-                    location_info = {
-                        "center": [sum(lons)/len(lons), sum(lats)/len(lats)],
-                        "bbox": [min(lats), max(lats), min(lons), max(lons)]
-                    }
-            
         except Exception as e:
-            print(f"  ✗ Error: {e}")
+            print(f"  ✗ [{year}] Error: {e}")
     else:
         print(f"\n[{year}] No network shapefile found")
     
@@ -154,55 +292,96 @@ for year in years:
         print(f"[{year}] Processing polygons: {shp_path.name}")
         
         try:
-            geojson = shapefile_to_geojson(shp_path)
-            
-            for feature in geojson['features']:
-                feature['properties']['year'] = year
-            
             output_file = FRONTEND_DATA_DIR / f"polygons_{year}.geojson"
-            with open(output_file, 'w') as f:
-                json.dump(geojson, f)
+            count = save_geojson(shapefile_to_geojson(shp_path, year), output_file)
             
-            print(f"  ✓ Saved: {output_file.name}")
-            print(f"    Features: {len(geojson['features'])}")
+            print(f"  ✓ [{year}] Saved: {output_file.name}")
+            print(f"    Features: {count}")
             polygon_converted = True
             
         except Exception as e:
-            print(f"  ✗ Error: {e}")
+            print(f"  ✗ [{year}] Error: {e}")
     else:
         print(f"[{year}] No polygon shapefile found")
     
-    if network_converted or polygon_converted:
-        converted_years.append(year)
-
-if not converted_years:
-    print("\n❌ No data was converted!")
-    exit(1)
-
-# Create a manifest file with metadata
-manifest = {
-    "name": "Brooklyn Central Pedestrian Infrastructure",
-    "years": converted_years,
-    "location": {
-        "name": "Brooklyn Central", 
-        "center": location_info["center"] if location_info else [-73.9695, 40.6744],
-        "zoom": 16,
-        "bbox": location_info["bbox"] if location_info else [40.6733, 40.6754, -73.9709, -73.9682]
-    },
-    "files": {
-        str(year): {
-            "network": f"network_{year}.geojson",
-            "polygons": f"polygons_{year}.geojson"
-        } for year in converted_years
-    }
-}
+    return year, network_converted or polygon_converted, vertex_stats
 
-manifest_file = FRONTEND_DATA_DIR / "manifest.json"
-with open(manifest_file, 'w') as f:
-    json.dump(manifest, f, indent=2)
+def main():
+    parser = argparse.ArgumentParser(description="Convert tile2net shapefiles to GeoJSON for the frontend")
+    parser.add_argument("years", nargs="*", type=int, metavar="YEAR",
+                        help="years to convert (default: every bk_central_YYYY folder)")
+    args = parser.parse_args()
+    
+    # Years named on the command line, or every year in the output folder
+    if args.years:
+        years = requested_years(args.years)
+    else:
+        years = discover_years()
+    
+    if not years:
+        print("No bk_central_YYYY folders found in output/")
+        exit(1)
+    
+    print("Converting tile2net shapefiles to GeoJSON...")
+    print("=" * 50)
+    print(f"Found years: {years}")
+    
+    # Track successful conversions
+    converted_years = []
+    location_info = None
+    
+    # Running vertex sum/count and extent over every converted network
+    vertex_stats = new_vertex_stats()
+    
+    # Years are independent, so convert them in parallel; results come back
+    # in year order
+    with ProcessPoolExecutor(max_workers=min(len(years), os.cpu_count() or 1)) as executor:
+        for year, converted, stats in executor.map(convert_year, years):
+            merge_vertex_stats(vertex_stats, stats)
+            if converted:
+                converted_years.append(year)
+    
+    if not converted_years:
+        print("\n❌ No data was converted!")
+        exit(1)
+    
+    # Center the map on the mean vertex of all networks, not just one feature
+    if vertex_stats["count"]:
+        center_lon, center_lat = (vertex_stats["sum"] / vertex_stats["count"]).tolist()
+        min_lon, min_lat = vertex_stats["min"].tolist()
+        max_lon, max_lat = vertex_stats["max"].tolist()
+        location_info = {
+            "center": [center_lon, center_lat],
+            "bbox": [min_lat, max_lat, min_lon, max_lon]
+        }
+    
+    # Create a manifest file with metadata
+    manifest = {
+        "name": "Brooklyn Central Pedestrian Infrastructure",
+        "years": converted_years,
+        "location": {
+            "name": "Brooklyn Central", 
+            "center": location_info["center"] if location_info else [-73.9695, 40.6744],
+            "zoom": 16,
+            "bbox": location_info["bbox"] if location_info else [40.6733, 40.6754, -73.9709, -73.9682]
+        },
+        "files": {
+            str(year): {
+                "network": f"network_{year}.geojson",
+                "network_seq": f"network_{year}.geojsonl",
+                "polygons": f"polygons_{year}.geojson"
+            } for year in converted_years
+        }
+    }
+    
+    manifest_file = FRONTEND_DATA_DIR / "manifest.json"
+    manifest_file.write_bytes(dumps(manifest, indent=True))
+    
+    print(f"\n{'=' * 50}")
+    print(f"✅ Conversion complete!")
+    print(f"📅 Years converted: {converted_years}")
+    print(f"📁 Files saved to: {FRONTEND_DATA_DIR.absolute()}")
+    print(f"📋 Manifest: {manifest_file.name}")
 
-print(f"\n{'=' * 50}")
-print(f"✅ Conversion complete!")
-print(f"📅 Years converted: {converted_years}")
-print(f"📁 Files saved to: {FRONTEND_DATA_DIR.absolute()}")
-print(f"📋 Manifest: {manifest_file.name}")
+if __name__ == "__main__":
+    main()
@@ -10,16 +10,56 @@ Available years: 2018, 2016, 2014, 2012, 2010, 2008, 2006, 2004, 2001-2, 1996, 1
 """
 
 import os
+import json
 import math
+import asyncio
 import requests
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import numpy as np
 from PIL import Image
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from tile_common import decode_tile
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import pyvips
+except ImportError:
+    pyvips = None
 
 # Tile size (standard web map tiles)
 TILE_SIZE = 256
 
+# XYZ tile URL pattern for NYC aerial photography
+TILE_URL = "https://maps.nyc.gov/xyz/1.0.0/photo/{year}/{z}/{x}/{y}.png8"
+
+# Per-directory record of tiles the server answered 404 for, so re-runs
+# don't request them again
+NOT_FOUND_FILE = ".missing.json"
+
+# Statuses worth retrying (rate limiting and transient server errors)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Extra passes over tiles that still failed after their own retries
+RETRY_ROUNDS = 1
+
+# Longest Retry-After wait honoured (seconds); a server asking for more
+# would otherwise hold a connection slot for as long as it likes
+MAX_RETRY_AFTER = 60
+
+# Per-request socket timeouts (seconds). They only run once a request has a
+# connection, so time spent waiting for a free pool slot does not count
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30
+
+
 def lat_lon_to_tile(lat, lon, zoom):
     """Convert lat/lon to tile coordinates at given zoom level."""
     lat_rad = math.radians(lat)
@@ -29,47 +69,180 @@ def lat_lon_to_tile(lat, lon, zoom):
     return x, y
 
 
+def lat_lon_to_tile_array(lats, lons, zoom):
+    """Vectorized lat_lon_to_tile: convert arrays of lat/lon to tile x/y arrays."""
+    lat_rad = np.radians(lats)
+    n = 2.0 ** zoom
+    xs = ((np.asarray(lons) + 180.0) / 360.0 * n).astype(np.int64)
+    ys = ((1.0 - np.arcsinh(np.tan(lat_rad)) / np.pi) / 2.0 * n).astype(np.int64)
+    return xs, ys
+
+
 def get_tile_bounds(zoom, min_lat, min_lon, max_lat, max_lon):
     """Get the range of tile coordinates for a bounding box."""
     # Note: min_lat is actually the southern bound (lower y value in lat)
     # In tile coordinates, higher y = further south
-    x_min, y_max = lat_lon_to_tile(min_lat, min_lon, zoom)
-    x_max, y_min = lat_lon_to_tile(max_lat, max_lon, zoom)
+    (x_min, x_max), (y_max, y_min) = (
+        a.tolist() for a in lat_lon_to_tile_array([min_lat, max_lat], [min_lon, max_lon], zoom)
+    )
     return x_min, x_max, y_min, y_max
 
 
-def download_tile(url, filepath, retries=3):
-    """Download a single tile with retry logic."""
+def tile_grid(tile_bounds):
+    """
+    Return every tile of a tile range as flat x/y arrays plus their file names.
+    
+    Tiles come x-major (all y for the first x, then the next x), the order
+    of the nested x/y loops this replaces; names are built as one array.
+    """
+    x_min, x_max, y_min, y_max = tile_bounds
+    xs, ys = np.meshgrid(np.arange(x_min, x_max + 1), np.arange(y_min, y_max + 1), indexing='ij')
+    xs, ys = xs.ravel(), ys.ravel()
+    names = np.char.add(np.char.add(np.char.add(xs.astype(str), '_'), ys.astype(str)), '.png')
+    return xs, ys, names
+
+
+def retry_after_seconds(value):
+    """
+    Seconds requested by a Retry-After header, capped at MAX_RETRY_AFTER.
+    
+    Returns 0 when the header is missing, an HTTP-date or otherwise not a
+    number of seconds, so the caller's exponential backoff applies.
+    """
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return 0
+    if not math.isfinite(seconds):
+        return 0
+    return min(max(seconds, 0), MAX_RETRY_AFTER)
+
+
+class CappedRetry(Retry):
+    """urllib3 Retry whose Retry-After waits are capped at MAX_RETRY_AFTER."""
+    
+    def parse_retry_after(self, retry_after):
+        return min(super().parse_retry_after(retry_after), MAX_RETRY_AFTER)
+
+
+async def download_tile(session, url, filepath, retries=3):
+    """
+    Download a single tile with retry logic.
+    
+    Returns (success, filepath, error, transient); transient marks failures
+    worth another try later (a RETRY_STATUSES answer, a connection error or
+    a timeout).
+    """
     for attempt in range(retries):
+        # Exponential backoff, matching the urllib3 Retry used for requests
+        delay = 0.5 * 2 ** attempt
         try:
-            response = requests.get(url, timeout=30)
-            if response.status_code == 200:
-                with open(filepath, 'wb') as f:
-                    f.write(response.content)
-                return True, filepath, None
-            elif response.status_code == 404:
-                # Tile doesn't exist (outside coverage area)
-                return False, filepath, "404 - Not Found"
-            else:
-                if attempt == retries - 1:
-                    return False, filepath, f"HTTP {response.status_code}"
-        except Exception as e:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    data = await response.read()
+                    # Keep the event loop free while the tile hits the disk
+                    await asyncio.to_thread(filepath.write_bytes, data)
+                    return True, filepath, None, False
+                elif response.status == 404:
+                    # Tile doesn't exist (outside coverage area)
+                    return False, filepath, "404 - Not Found", False
+                elif response.status not in RETRY_STATUSES:
+                    return False, filepath, f"HTTP {response.status}", False
+                elif attempt == retries - 1:
+                    return False, filepath, f"HTTP {response.status}", True
+                # Wait at least as long as the server asks when throttled
+                delay = max(delay, retry_after_seconds(response.headers.get('Retry-After')))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             if attempt == retries - 1:
-                return False, filepath, str(e)
-        time.sleep(0.5 * (attempt + 1))
-    return False, filepath, "Max retries exceeded"
+                return False, filepath, str(e) or type(e).__name__, True
+        except Exception as e:
+            return False, filepath, str(e), False
+        await asyncio.sleep(delay)
+    return False, filepath, "Max retries exceeded", True
+
+
+def download_tile_blocking(session, url, filepath):
+    """
+    Download a single tile over a shared requests.Session.
+    
+    Retries and backoff are handled by the session's adapter (see
+    tile_fetcher), so this makes one logical request per tile. Returns the
+    same (success, filepath, error, transient) tuple as download_tile.
+    """
+    try:
+        response = session.get(url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+    except (requests.ConnectionError, requests.Timeout) as e:
+        return False, filepath, str(e), True
+    except Exception as e:
+        return False, filepath, str(e), False
+    if response.status_code == 200:
+        with open(filepath, 'wb') as f:
+            f.write(response.content)
+        return True, filepath, None, False
+    elif response.status_code == 404:
+        # Tile doesn't exist (outside coverage area)
+        return False, filepath, "404 - Not Found", False
+    return False, filepath, f"HTTP {response.status_code}", response.status_code in RETRY_STATUSES
+
+
+@asynccontextmanager
+async def tile_fetcher(max_connections):
+    """
+    Yield fetch(url, filepath), returning an awaitable (success, filepath, error, transient).
+    
+    Uses aiohttp when it is installed; otherwise a thread pool shares one
+    requests.Session whose adapter keeps up to max_connections connections
+    alive, so either way handshakes are not repeated per tile. At most
+    max_connections fetches are in flight at once (a semaphore for aiohttp,
+    the pool's worker count for requests); the rest wait without starting.
+    """
+    if aiohttp is not None:
+        connector = aiohttp.TCPConnector(
+            limit=max_connections,
+            limit_per_host=max_connections,
+            ttl_dns_cache=600,
+            keepalive_timeout=60,
+        )
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+        semaphore = asyncio.Semaphore(max_connections)
+        
+        async def fetch(url, fp):
+            async with semaphore:
+                return await download_tile(session, url, fp)
+        
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            yield fetch
+    else:
+        loop = asyncio.get_running_loop()
+        retry = CappedRetry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=["GET"],
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max_connections, max_retries=retry)
+        with requests.Session() as session, ThreadPoolExecutor(max_workers=max_connections) as executor:
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers["Connection"] = "keep-alive"
+            yield lambda url, fp: loop.run_in_executor(executor, download_tile_blocking, session, url, fp)
 
 
-def download_tiles_for_area(year, zoom, bbox, output_dir, max_workers=8):
+async def download_tiles_for_area(year, zoom, bbox, output_dir, max_connections=64):
     """
     Download all tiles for a given area and year.
     
+    All requests go through one pooled session (see tile_fetcher), so
+    TCP/TLS connections to the tile server are opened once and kept alive
+    across tiles instead of being set up again for every request.
+    
     Args:
         year: Year of aerial photography (e.g., 2016)
         zoom: Zoom level (19 is high detail)
         bbox: Bounding box as [north_lat, west_lon, south_lat, east_lon]
         output_dir: Directory to save tiles
-        max_workers: Number of parallel download threads
+        max_connections: Maximum number of concurrent connections
     
     Returns:
         Tuple of (downloaded_count, failed_count, tile_bounds)
@@ -86,43 +259,82 @@ def download_tiles_for_area(year, zoom, bbox, output_dir, max_workers=8):
     tiles_dir = Path(output_dir) / f"nyc_{year}" / f"{TILE_SIZE}_{zoom}"
     tiles_dir.mkdir(parents=True, exist_ok=True)
     
-    # Build list of tiles to download
-    tiles_to_download = []
-    for x in range(x_min, x_max + 1):
-        for y in range(y_min, y_max + 1):
-            # XYZ tile URL for NYC maps
-            url = f"https://maps.nyc.gov/xyz/1.0.0/photo/{year}/{zoom}/{x}/{y}.png8"
-            filepath = tiles_dir / f"{x}_{y}.png"
-            if not filepath.exists():
-                tiles_to_download.append((url, filepath))
-    
-    print(f"Tiles to download: {len(tiles_to_download)} (skipping {(x_max - x_min + 1) * (y_max - y_min + 1) - len(tiles_to_download)} existing)")
+    # Build list of tiles to download; the tiles already on disk come from
+    # one directory read instead of an exists() stat per tile
+    with os.scandir(tiles_dir) as entries:
+        existing = [entry.name for entry in entries]
+    
+    # Tiles that came back 404 on an earlier run are skipped as well
+    not_found_path = tiles_dir / NOT_FOUND_FILE
+    try:
+        not_found = set(json.loads(not_found_path.read_text()))
+    except (OSError, ValueError):
+        not_found = set()
+    
+    xs, ys, names = tile_grid((x_min, x_max, y_min, y_max))
+    on_disk = np.isin(names, existing)
+    known_404 = np.isin(names, list(not_found)) & ~on_disk
+    missing = ~(on_disk | known_404)
+    tiles_to_download = [
+        # XYZ tile URL for NYC maps
+        (TILE_URL.format(year=year, z=zoom, x=x, y=y), tiles_dir / filename)
+        for x, y, filename in zip(xs[missing].tolist(), ys[missing].tolist(), names[missing].tolist())
+    ]
+    
+    print(f"Tiles to download: {len(tiles_to_download)} (skipping {int(on_disk.sum())} existing, {int(known_404.sum())} known 404)")
     
     if not tiles_to_download:
         print("All tiles already downloaded!")
         return 0, 0, (x_min, x_max, y_min, y_max)
     
-    # Download tiles in parallel
+    # Download tiles concurrently over a pool of persistent connections;
+    # tiles that failed transiently (see download_tile) get further rounds
+    # at the end, while 404s and other permanent failures are not retried
     downloaded = 0
-    failed = 0
     failed_tiles = []
-    
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(download_tile, url, fp): (url, fp) for url, fp in tiles_to_download}
-        
-        for i, future in enumerate(as_completed(futures)):
-            success, filepath, error = future.result()
-            if success:
-                downloaded += 1
-            else:
-                failed += 1
-                if error != "404 - Not Found":  # Don't report 404s as failures
-                    failed_tiles.append((filepath, error))
-            
-            # Progress update
-            if (i + 1) % 50 == 0 or i + 1 == len(tiles_to_download):
-                print(f"Progress: {i + 1}/{len(tiles_to_download)} (Downloaded: {downloaded}, Failed: {failed})")
-    
+    retry_tiles = []
+    urls = {fp: url for url, fp in tiles_to_download}
+    pending = tiles_to_download
+    
+    new_not_found = set()
+    try:
+        async with tile_fetcher(max_connections) as fetch:
+            for round_number in range(RETRY_ROUNDS + 1):
+                if round_number:
+                    print(f"\n🔁 Retry round {round_number}: {len(pending)} tiles with transient errors")
+                failed = 0
+                retry_tiles = []
+                tasks = [fetch(url, fp) for url, fp in pending]
+                
+                for i, future in enumerate(asyncio.as_completed(tasks)):
+                    success, filepath, error, transient = await future
+                    if success:
+                        downloaded += 1
+                    else:
+                        failed += 1
+                        if error == "404 - Not Found":  # Don't report 404s as failures
+                            new_not_found.add(filepath.name)
+                        elif transient:
+                            retry_tiles.append((filepath, error))
+                        else:
+                            failed_tiles.append((filepath, error))
+                    
+                    # Progress update
+                    if (i + 1) % 50 == 0 or i + 1 == len(pending):
+                        print(f"Progress: {i + 1}/{len(pending)} (Downloaded: {downloaded}, Failed: {failed})")
+                
+                pending = [(urls[fp], fp) for fp, _ in retry_tiles]
+                if not pending:
+                    break
+    finally:
+        # Keep the 404s seen so far even if the run is interrupted
+        if new_not_found:
+            not_found_path.write_text(json.dumps(sorted(not_found | new_not_found)))
+    
+    failed = len(tiles_to_download) - downloaded
+    
+    # Transient failures still left after the last round count as failed too
+    failed_tiles += retry_tiles
     if failed_tiles:
         print(f"\nFailed tiles (non-404):")
         for fp, err in failed_tiles[:10]:
@@ -133,51 +345,95 @@ def download_tiles_for_area(year, zoom, bbox, output_dir, max_workers=8):
     return downloaded, failed, (x_min, x_max, y_min, y_max)
 
 
+def save_mosaic(canvas, output_path):
+    """
+    Save an (H, W, 3) uint8 mosaic to PNG, or JPEG for a .jpg/.jpeg path.
+    
+    libvips encodes large images multi-threaded, so it is used when pyvips
+    is installed; otherwise the image is saved with PIL.
+    """
+    if pyvips is not None:
+        height, width, bands = canvas.shape
+        image = pyvips.Image.new_from_memory(canvas.data, width, height, bands, 'uchar')
+        if Path(output_path).suffix.lower() in ('.jpg', '.jpeg'):
+            image.jpegsave(str(output_path), Q=95)
+        else:
+            image.pngsave(str(output_path), compression=6)
+    else:
+        Image.fromarray(canvas).save(output_path, quality=95)
+
+
+def tile_snapshot(tiles_dir):
+    """Map each tile file name in tiles_dir to [size, mtime_ns], from one scandir pass."""
+    with os.scandir(tiles_dir) as entries:
+        return {
+            entry.name: [entry.stat().st_size, entry.stat().st_mtime_ns]
+            for entry in entries
+            if entry.name.endswith('.png') and entry.is_file()
+        }
+
+
 def stitch_tiles(tiles_dir, output_path, tile_bounds):
-    """Stitch downloaded tiles into a single image."""
+    """
+    Stitch downloaded tiles into a single image.
+    
+    The tile sizes and mtimes used for a stitch are recorded in
+    tiles_dir/.stitch.json; when nothing has changed since and the output
+    still exists, the stitch is skipped.
+    """
     x_min, x_max, y_min, y_max = tile_bounds
     
+    # Skip re-stitching when the tiles on disk are the ones last stitched
+    stitch_manifest = Path(tiles_dir) / ".stitch.json"
+    snapshot = {
+        "output": str(output_path),
+        "tile_bounds": list(tile_bounds),
+        "tiles": tile_snapshot(tiles_dir),
+    }
+    if Path(output_path).exists() and stitch_manifest.exists():
+        try:
+            unchanged = json.loads(stitch_manifest.read_text()) == snapshot
+        except ValueError:
+            unchanged = False
+        if unchanged:
+            print(f"\nTiles unchanged since last stitch, keeping: {output_path}")
+            return Image.open(output_path)
+    
     width = (x_max - x_min + 1) * TILE_SIZE
     height = (y_max - y_min + 1) * TILE_SIZE
     
     print(f"\nStitching tiles into {width}x{height} image...")
     
-    # Create output image with gray background (to show missing tiles)
-    output_image = Image.new('RGB', (width, height), color=(128, 128, 128))
+    # Preallocate the mosaic as one RGB array with a gray background (to show
+    # missing tiles); tiles are copied in with slice assignment
+    canvas = np.full((height, width, 3), 128, dtype=np.uint8)
     
     tiles_placed = 0
     black_tiles = []
     
-    for x in range(x_min, x_max + 1):
-        for y in range(y_min, y_max + 1):
-            tile_path = tiles_dir / f"{x}_{y}.png"
-            if tile_path.exists():
-                try:
-                    tile = Image.open(tile_path)
-                    
-                    # Check if tile is mostly black
-                    if tile.mode in ('RGB', 'RGBA', 'P'):
-                        gray = tile.convert('L')
-                        pixels = list(gray.getdata())
-                        avg_brightness = sum(pixels) / len(pixels)
-                        if avg_brightness < 5:
-                            black_tiles.append((x, y, avg_brightness))
-                    
-                    # Calculate position
-                    pos_x = (x - x_min) * TILE_SIZE
-                    pos_y = (y - y_min) * TILE_SIZE
-                    
-                    # Convert and paste
-                    if tile.mode == 'RGBA':
-                        output_image.paste(tile.convert('RGB'), (pos_x, pos_y))
-                    elif tile.mode == 'P':
-                        output_image.paste(tile.convert('RGB'), (pos_x, pos_y))
-                    else:
-                        output_image.paste(tile, (pos_x, pos_y))
-                    
-                    tiles_placed += 1
-                except Exception as e:
-                    print(f"Error loading {tile_path}: {e}")
+    # Decode tiles on a thread pool (PNG inflate releases the GIL); the main
+    # thread copies each decoded tile into the canvas, in grid order
+    xs, ys, names = tile_grid(tile_bounds)
+    present = np.isin(names, list(snapshot["tiles"]))
+    coords = list(zip(xs[present].tolist(), ys[present].tolist()))
+    tile_paths = [tiles_dir / name for name in names[present].tolist()]
+    
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for (x, y), tile_path, (rgb, avg_brightness, error) in zip(
+                coords, tile_paths, executor.map(decode_tile, tile_paths, [TILE_SIZE] * len(tile_paths))):
+            if error is not None:
+                print(f"Error loading {tile_path}: {error}")
+                continue
+            
+            if avg_brightness is not None and avg_brightness < 5:
+                black_tiles.append((x, y, avg_brightness))
+            
+            # Calculate position
+            pos_x = (x - x_min) * TILE_SIZE
+            pos_y = (y - y_min) * TILE_SIZE
+            
+            canvas[pos_y:pos_y + TILE_SIZE, pos_x:pos_x + TILE_SIZE] = rgb
+            tiles_placed += 1
     
     print(f"Tiles placed: {tiles_placed}")
     
@@ -190,10 +446,11 @@ def stitch_tiles(tiles_dir, output_path, tile_bounds):
     
     # Save output
     print(f"\nSaving stitched image to: {output_path}")
-    output_image.save(output_path, quality=95)
+    save_mosaic(canvas, output_path)
+    stitch_manifest.write_text(json.dumps(snapshot))
     print("Done!")
     
-    return output_image
+    return Image.fromarray(canvas)
 
 
 def main():
@@ -234,18 +491,19 @@ def main():
     
     # Download tiles
     print("📥 Downloading tiles...")
-    downloaded, failed, tile_bounds = download_tiles_for_area(
+    downloaded, failed, tile_bounds = asyncio.run(download_tiles_for_area(
         year=year,
         zoom=zoom,
         bbox=bbox,
         output_dir=output_dir,
-        max_workers=8
-    )
+        max_connections=64
+    ))
     
     print(f"\n✅ Download complete: {downloaded} downloaded, {failed} failed/missing")
     
-    # Stitch tiles
-    stitched_path = output_dir / f"nyc_{year}_stitched.png"
+    # Stitch tiles; the mosaic is only for looking at, so write JPEG, which
+    # encodes far faster than PNG for aerial photos and is a fraction the size
+    stitched_path = output_dir / f"nyc_{year}_stitched.jpg"
     stitch_tiles(tiles_dir, stitched_path, tile_bounds)
     
     print("\n" + "=" * 60)
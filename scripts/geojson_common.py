@@ -0,0 +1,97 @@
+"""
+Shared GeoJSON output helpers for the convert_* scripts: JSON serialization,
+per-column property conversion and the streaming FeatureCollection writer.
+"""
+import json
+import os
+from pathlib import Path
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Output files are written through a 1 MiB buffer
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+def dumps(obj, indent=False):
+    """Serialize to JSON bytes, with orjson when it is installed"""
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option)
+    if indent:
+        return json.dumps(obj, indent=2, default=_to_list).encode()
+    return json.dumps(obj, separators=(',', ':'), default=_to_list).encode()
+
+
+def _to_list(obj):
+    """json fallback for numpy coordinate arrays"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def stringify(props, columns):
+    """Convert the non-null values of the given columns to str, in place"""
+    for name in columns:
+        if props[name] is not None:
+            props[name] = str(props[name])
+    return props
+
+
+def save_geojson(features, output_path, metadata=None, seq_path=None):
+    """
+    Stream features into a GeoJSON FeatureCollection file
+
+    Features are serialized one at a time as they arrive, so the collection
+    is never held in memory. metadata is written after the last feature, so
+    it may be filled in while the stream is consumed; total_features is added
+    to it. When seq_path is given the same features are also written there
+    as newline-delimited GeoJSON (one feature per line), in the same pass.
+    A feature given as bytes is taken to be serialized already and is
+    written as is.
+
+    Files are written next to their targets and only moved into place once
+    complete, so an interrupted run never leaves a truncated file behind.
+    Returns the number of features saved
+    """
+    tmp_path = Path(f"{output_path}.tmp")
+    seq_tmp_path = Path(f"{seq_path}.tmp") if seq_path else None
+    count = 0
+    seq_file = None
+    try:
+        if seq_path:
+            seq_file = open(seq_tmp_path, 'wb', buffering=WRITE_BUFFER_SIZE)
+        with open(tmp_path, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+            f.write(b'{"type":"FeatureCollection","features":[')
+            for feature in features:
+                data = feature if isinstance(feature, bytes) else dumps(feature)
+                if count:
+                    f.write(b',')
+                count += 1
+                f.write(data)
+                if seq_file:
+                    seq_file.write(data)
+                    seq_file.write(b'\n')
+            f.write(b']')
+            if metadata is not None:
+                metadata["total_features"] = count
+                f.write(b',"metadata":')
+                f.write(dumps(metadata))
+            f.write(b'}')
+        if seq_file:
+            seq_file.close()
+    except BaseException:
+        # Don't leave partial .tmp files behind next to the outputs
+        if seq_file:
+            seq_file.close()
+            seq_tmp_path.unlink(missing_ok=True)
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    os.replace(tmp_path, output_path)
+    if seq_path:
+        os.replace(seq_tmp_path, seq_path)
+    return count
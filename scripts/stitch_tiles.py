@@ -5,21 +5,56 @@ This helps debug why some files in the stitched version might be black.
 """
 
 import os
-import glob
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import numpy as np
 from PIL import Image
-import re
+
+from tile_common import decode_tile
+
+try:
+    import pyvips
+except ImportError:
+    pyvips = None
+
+# Background color for grid cells without a tile
+BACKGROUND = (200, 200, 200)
 
 
 def parse_tile_filename(filename):
     """Extract X and Y coordinates from tile filename like '154375_197162.png'"""
     basename = os.path.basename(filename)
-    match = re.match(r'(\d+)_(\d+)\.png', basename)
-    if match:
-        return int(match.group(1)), int(match.group(2))
+    # Plain string splitting; the name format is too simple to need a regex
+    if basename.endswith('.png'):
+        x, sep, y = basename[:-4].partition('_')
+        if sep and x.isdigit() and y.isdigit():
+            return int(x), int(y)
     return None, None
 
 
+def save_stitched(canvas, output_path):
+    """
+    Write the stitched canvas to output_path.
+    
+    With pyvips available the encode is done by libvips, and a .tif/.tiff
+    path gets a tiled, JPEG-compressed pyramid that viewers can open
+    without reading the whole mosaic. Otherwise PIL saves the image.
+    """
+    if pyvips is None:
+        Image.fromarray(canvas).save(output_path, quality=95)
+        return
+    
+    height, width, bands = canvas.shape
+    image = pyvips.Image.new_from_memory(canvas.data, width, height, bands, 'uchar')
+    suffix = Path(output_path).suffix.lower()
+    if suffix in ('.tif', '.tiff'):
+        image.tiffsave(str(output_path), tile=True, pyramid=True, compression='jpeg', Q=95)
+    elif suffix in ('.jpg', '.jpeg'):
+        image.jpegsave(str(output_path), Q=95)
+    else:
+        image.write_to_file(str(output_path))
+
+
 def stitch_tiles(input_dir, output_path, tile_size=256):
     """
     Stitch all PNG tiles in input_dir into a single image.
@@ -29,8 +64,12 @@ def stitch_tiles(input_dir, output_path, tile_size=256):
         output_path: Path to save the stitched output image
         tile_size: Size of each tile (default 256)
     """
-    # Get all PNG files
-    tile_files = glob.glob(os.path.join(input_dir, '*.png'))
+    # Get all PNG files (one directory scan, no per-pattern globbing)
+    with os.scandir(input_dir) as entries:
+        tile_files = [
+            entry.path for entry in entries
+            if entry.name.endswith('.png') and not entry.name.startswith('.')
+        ]
     
     if not tile_files:
         print(f"No PNG files found in {input_dir}")
@@ -69,37 +108,31 @@ def stitch_tiles(input_dir, output_path, tile_size=256):
     black_tiles = []
     empty_tiles = []
     
-    # Create the output image (RGB, white background)
-    # Using white background to make missing tiles visible
-    output_image = Image.new('RGB', (width, height), color=(200, 200, 200))
-    
-    # Place each tile
-    for x, y, filepath in tiles:
-        try:
-            tile = Image.open(filepath)
+    # Preallocate the output as one RGB array with a light gray background
+    # (to make missing tiles visible); tiles are copied in by slice assignment
+    canvas = np.empty((height, width, 3), dtype=np.uint8)
+    canvas[:] = BACKGROUND
+    
+    # Decode tiles on a thread pool (PNG inflate releases the GIL); only
+    # the copy into the canvas happens on this thread, in listing order
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        results = executor.map(decode_tile, (filepath for _, _, filepath in tiles),
+                               [tile_size] * len(tiles), [BACKGROUND] * len(tiles))
+        for (x, y, filepath), (rgb, avg_brightness, error) in zip(tiles, results):
+            if error is not None:
+                print(f"Error loading {filepath}: {error}")
+                empty_tiles.append((x, y, filepath))
+                continue
             
-            # Check if tile is mostly black
-            if tile.mode == 'RGB' or tile.mode == 'RGBA':
-                # Convert to grayscale to check brightness
-                gray = tile.convert('L')
-                avg_brightness = sum(gray.getdata()) / (tile.width * tile.height)
-                if avg_brightness < 5:  # Very dark
-                    black_tiles.append((x, y, filepath, avg_brightness))
+            if avg_brightness is not None and avg_brightness < 5:  # Very dark
+                black_tiles.append((x, y, filepath, avg_brightness))
             
             # Calculate position in output image
             # Note: Y increases downward in image coordinates
             pos_x = (x - min_x) * tile_size
             pos_y = (y - min_y) * tile_size
             
-            # Paste tile (convert to RGB if needed)
-            if tile.mode == 'RGBA':
-                output_image.paste(tile, (pos_x, pos_y), tile)
-            else:
-                output_image.paste(tile.convert('RGB'), (pos_x, pos_y))
-                
-        except Exception as e:
-            print(f"Error loading {filepath}: {e}")
-            empty_tiles.append((x, y, filepath))
+            canvas[pos_y:pos_y + tile_size, pos_x:pos_x + tile_size] = rgb
     
     # Report black tiles
     if black_tiles:
@@ -114,35 +147,40 @@ def stitch_tiles(input_dir, output_path, tile_size=256):
         for x, y, filepath in empty_tiles[:10]:
             print(f"  - {os.path.basename(filepath)}")
     
-    # Check for gaps in the tile grid
+    # Check for gaps in the tile grid; every parsed tile lies inside the
+    # grid, so the gap count is known without building the full set, and
+    # walking the grid in (x, y) order yields the first gaps already sorted
     tile_coords = set((t[0], t[1]) for t in tiles)
-    expected_tiles = set()
-    for x in range(min_x, max_x + 1):
-        for y in range(min_y, max_y + 1):
-            expected_tiles.add((x, y))
-    
-    missing_tiles = expected_tiles - tile_coords
-    if missing_tiles:
-        print(f"\n⚠️  Missing {len(missing_tiles)} tiles in the grid (will appear gray):")
-        for x, y in sorted(missing_tiles)[:20]:
-            print(f"  - {x}_{y}.png")
-        if len(missing_tiles) > 20:
-            print(f"  ... and {len(missing_tiles) - 20} more")
+    missing_count = (max_x - min_x + 1) * (max_y - min_y + 1) - len(tile_coords)
+    if missing_count:
+        print(f"\n⚠️  Missing {missing_count} tiles in the grid (will appear gray):")
+        shown = 0
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                if (x, y) not in tile_coords:
+                    print(f"  - {x}_{y}.png")
+                    shown += 1
+                    if shown == 20:
+                        break
+            if shown == 20:
+                break
+        if missing_count > 20:
+            print(f"  ... and {missing_count - 20} more")
     
     # Save output
     print(f"\nSaving stitched image to: {output_path}")
-    output_image.save(output_path, quality=95)
+    save_stitched(canvas, output_path)
     print("Done!")
     
-    return output_image
+    return Image.fromarray(canvas)
 
 
 if __name__ == '__main__':
     # Input directory with tiles
     input_dir = '/Users/suape/WorkDir/tile2net/output/bk_central_2022/bk_central_2022/tiles/static/nys_2022/256_19'
     
-    # Output path for stitched image
-    output_path = '/Users/suape/WorkDir/tile2net/output/bk_central_2022/bk_central_2022_stitched.png'
+    # Output path for stitched image (JPEG; PNG is much slower to encode)
+    output_path = '/Users/suape/WorkDir/tile2net/output/bk_central_2022/bk_central_2022_stitched.jpg'
     
     # Tile size
     tile_size = 256
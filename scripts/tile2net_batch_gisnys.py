@@ -1,30 +1,15 @@
 import modal
 import os
 
-image = (
-    modal.Image.debian_slim(python_version="3.10")
-    .apt_install(
-        "git", "libgdal-dev", "gdal-bin", "libspatialindex-dev",
-        "libgl1", "libglib2.0-0"
-    )
-    .pip_install(
-        "numpy<2.0",
-        "git+https://github.com/VIDA-NYU/tile2net.git",
-        "urllib3<2.0"
-    )
-)
+from tile2net_common import image, run_inference, vol
 
 app = modal.App("tile2net-nyc-batch")
-vol = modal.Volume.from_name("tile2net-data", create_if_missing=True)
 
-@app.function(
-    image=image,
-    gpu="A100-80GB",
-    cpu=4,
-    timeout=86400,
-    volumes={"/data": vol}
-)
-def process_year(year: int):
+# Merged tiles per inference batch (tile2net --bs_val); sized for the A100-80GB
+INFERENCE_BATCH_SIZE = 32
+
+def nys_raster(year: int):
+    """Build the tile2net Raster for one year of NYS orthoimagery over central Brooklyn."""
     from tile2net import Raster
     from tile2net.raster.source import Source
     
@@ -47,23 +32,42 @@ def process_year(year: int):
     project_name = f"bk_central_{year}"
     output_dir = "/data/outputs"
     os.makedirs(output_dir, exist_ok=True)
-    
+
+    return Raster(
+        location=location,
+        name=project_name,
+        output_dir=output_dir,
+        source=NYS_Source(year), 
+        zoom=19
+    )
+
+# Download and stitch on CPU (see tile2net_common)
+@app.function(
+    image=image,
+    cpu=4,
+    timeout=86400,
+    volumes={"/data": vol}
+)
+def prepare_year(year: int):
+    print(f"⬇️  Downloading tiles for {year}...")
+    raster = nys_raster(year)
+    raster.generate(4)
+    vol.commit()
+    return str(raster.project.tiles.info)
+
+@app.function(
+    image=image,
+    gpu="A100-80GB",
+    cpu=4,
+    timeout=86400,
+    volumes={"/data": vol}
+)
+def process_year(year: int, info_path: str):
     print(f"⏳ Processing Year: {year}")
     
     try:
-        raster = Raster(
-            location=location,
-            name=project_name,
-            output_dir=output_dir,
-            source=NYS_Source(year), 
-            zoom=19
-        )
-        
-        print(f"⬇️  Downloading tiles for {year}...")
-        raster.generate(4) 
-        
         print(f"🧠 Running Inference for {year}...")
-        raster.inference()
+        run_inference(info_path, "--bs_val", str(INFERENCE_BATCH_SIZE))
         
         return f"✅ Success: {year}"
     except Exception as e:
@@ -80,8 +84,17 @@ def main():
     
     print(f"🚀 Launching batch job for years: {years}")
     
-    # Run in parallel on Modal
-    results = list(process_year.map(years))
+    # Download every year in parallel on CPU containers, then only send the
+    # years that made it through to the GPU
+    ready, infos = [], []
+    for year, res in zip(years, prepare_year.map(years, return_exceptions=True)):
+        if isinstance(res, Exception):
+            print(f"❌ Error downloading {year}: {res}")
+        else:
+            ready.append(year)
+            infos.append(res)
+    
+    results = list(process_year.map(ready, infos))
     
     for res in results:
         print(res)
\ No newline at end of file
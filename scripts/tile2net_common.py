@@ -0,0 +1,100 @@
+"""
+Shared Modal setup for the tile2net scripts: the container image, the data
+volume, and the NYC XYZ aerial tile source.
+
+Every script builds on the same image so Modal only has to build (and cache)
+it once, instead of once per script.
+
+Raster.generate() downloads and stitches the tiles and writes the project
+info json; none of it needs a GPU. Each script therefore runs generate() in
+a CPU-only function, commits the volume and hands the info json path to its
+GPU function, which only calls run_inference().
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import modal
+
+image = (
+    modal.Image.debian_slim(python_version="3.10")
+    .apt_install(
+        "git", "libgdal-dev", "gdal-bin", "libspatialindex-dev",
+        "libgl1", "libglib2.0-0",
+        # build deps for pillow-simd below
+        "build-essential", "zlib1g-dev", "libjpeg-dev"
+    )
+    .pip_install(
+        "numpy<2.0",
+        "git+https://github.com/VIDA-NYU/tile2net.git",
+        "urllib3<2.0"
+    )
+    # Replace Pillow with the Pillow-SIMD fork (AVX2 loops for the tile
+    # convert/paste work), pinned to the release that tracks the Pillow
+    # tile2net pins (12.0.0) so its API is the one tile2net was tested with.
+    # The build is compiled with -mavx2, so every function using this image
+    # needs an x86_64 host with AVX2 (Haswell or newer); on a CPU without it
+    # importing PIL crashes with an illegal instruction
+    .run_commands(
+        "pip uninstall -y pillow",
+        "CC='cc -mavx2' pip install --no-cache-dir pillow-simd==12.0.0.post0",
+    )
+    # Ship this module into the container so remote functions can import it
+    .add_local_python_source("tile2net_common")
+)
+
+vol = modal.Volume.from_name("tile2net-data", create_if_missing=True)
+
+
+def nyc_xyz_source(year):
+    """
+    Return a tile2net Source for the maps.nyc.gov aerial photography of a year.
+
+    tile2net is only installed in the container, so the Source subclass is
+    defined on first use inside the remote function.
+    """
+    from tile2net.raster.source import Source
+
+    class NYC_XYZ_Source(Source):
+        ignore = True
+
+        def __init__(self, target_year):
+            self.year = target_year
+            self.tiles = f'https://maps.nyc.gov/xyz/1.0.0/photo/{target_year}/{{z}}/{{x}}/{{y}}.png8'
+            self.server = f'https://maps.nyc.gov/xyz/1.0.0/photo/{target_year}'
+            self.zoom = 19
+            self.extension = 'png'
+            self.name = f'nyc_{target_year}'
+            self.keyword = 'New York City'
+
+    return NYC_XYZ_Source(year)
+
+
+def run_inference(info_path, *args):
+    """
+    Run tile2net inference on a project prepared by Raster.generate().
+
+    info_path is the project info json that generate() wrote on the CPU
+    container. The volume is reloaded to see it, and a missing info json or
+    an empty stitched folder raises FileNotFoundError instead of the tiles
+    being fetched again on GPU time. args are passed on to the tile2net
+    inference command line, the same way Raster.inference passes them.
+    Returns the project folder on the volume.
+    """
+    vol.reload()
+    if not os.path.exists(info_path):
+        raise FileNotFoundError(f"No project info at {info_path}; run the prepare step first")
+    with open(info_path) as f:
+        info = json.load(f)
+    stitched = info["project"]["tiles"]["stitched"]
+    if not os.path.isdir(stitched) or not os.listdir(stitched):
+        raise FileNotFoundError(f"No stitched tiles in {stitched}; run the prepare step first")
+
+    subprocess.run(
+        [sys.executable, "-m", "tile2net", "inference",
+         "--city_info", str(info_path), "--interactive", *args],
+        check=True,
+    )
+    return os.path.join(info["output_dir"], info["name"])
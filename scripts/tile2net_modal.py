@@ -1,40 +1,17 @@
 import modal
 import os
 
-# 1. Define the image with system dependencies and tile2net
-image = (
-    modal.Image.debian_slim(python_version="3.10")
-    .apt_install(
-        "git",
-        "libgdal-dev",
-        "gdal-bin",
-        "libspatialindex-dev",
-        "libgl1",  
-        "libglib2.0-0"
-    )
-    .pip_install(
-        "numpy<2.0",
-        "git+https://github.com/VIDA-NYU/tile2net.git",
-        "urllib3<2.0"
-    )
-)
+# Container image and data volume shared by all tile2net scripts
+from tile2net_common import image, run_inference, vol
 
 app = modal.App("tile2net-runner")
 
-# 2. Create a persistent volume
-vol = modal.Volume.from_name("tile2net-data", create_if_missing=True)
+# Merged tiles per inference batch (tile2net --bs_val); sized for the 40 GB A100
+INFERENCE_BATCH_SIZE = 16
 
-@app.function(
-    image=image,
-    gpu="A100",
-    cpu=4,
-    memory=16384,
-    timeout=86400,
-    volumes={"/data": vol}
-)
-def run_tile2net(location_str: str, project_name: str, boundary_path: str | None = None):
+def build_raster(location_str: str, project_name: str, boundary_path: str | None = None):
+    """Create the project's Raster, clipped to boundary_path when it exists on the volume."""
     from tile2net import Raster
-    import shutil
 
     output_dir = f"/data/outputs"
     os.makedirs(output_dir, exist_ok=True)
@@ -63,25 +40,50 @@ def run_tile2net(location_str: str, project_name: str, boundary_path: str | None
         print(f"⚠️ Boundary skipped: Path '{boundary_path}' not found or not provided.")
     # --- FIX END ---
 
+    return raster
+
+# Step 1: download and stitch on CPU (see tile2net_common)
+@app.function(
+    image=image,
+    cpu=8,
+    memory=16384,
+    timeout=86400,
+    volumes={"/data": vol}
+)
+def prepare_tiles(location_str: str, project_name: str, boundary_path: str | None = None):
+    raster = build_raster(location_str, project_name, boundary_path)
+
     # Step 1: Generate 
     # Because we ran get_in_boundary, this will ONLY download tiles inside the shapefile
     # INCREASED thread count for faster downloads (was 4, now 16)
     print("⬇️  Downloading and stitching tiles...")
     raster.generate(16) 
+    vol.commit()
+    return str(raster.project.tiles.info)
 
+@app.function(
+    image=image,
+    gpu="A100",
+    cpu=4,
+    memory=16384,
+    timeout=86400,
+    volumes={"/data": vol}
+)
+def run_tile2net(info_path: str):
     # Step 2: Inference
     print("🧠 Running Inference (Segmentation)...")
-    raster.inference()
+    project_dir = run_inference(info_path, "--bs_val", str(INFERENCE_BATCH_SIZE))
     
-    print(f"✅ Done! Results saved to volume at {output_dir}/{project_name}")
+    print(f"✅ Done! Results saved to volume at {project_dir}")
     
-    return f"{output_dir}/{project_name}"
+    return project_dir
 
 @app.local_entrypoint()
 def main(location: str | None = None, name: str = "brooklyn_project"):
     import subprocess
     import os
     import json
+    import numpy as np
 
     # Define boundary file path
     boundary_file = "boundries/Borough Boundaries (Clipped to Shoreline).json"
@@ -111,22 +113,18 @@ def main(location: str | None = None, name: str = "brooklyn_project"):
                 
                 for feature in data['features']:
                     if feature['properties'].get('BoroName') == 'Brooklyn':
-                        minx, miny = float('inf'), float('inf')
-                        maxx, maxy = float('-inf'), float('-inf')
-                        
-                        def update_bounds(coords):
-                            nonlocal minx, miny, maxx, maxy
+                        def iter_points(coords):
                             for item in coords:
                                 if isinstance(item[0], (list, tuple)):
-                                    update_bounds(item)
+                                    yield from iter_points(item)
                                 else:
-                                    x, y = item
-                                    minx = min(minx, x)
-                                    miny = min(miny, y)
-                                    maxx = max(maxx, x)
-                                    maxy = max(maxy, y)
+                                    yield item
 
-                        update_bounds(feature['geometry']['coordinates'])
+                        # Collect the vertices once and take the bounds
+                        # with array reductions instead of per-point min/max
+                        points = np.array(list(iter_points(feature['geometry']['coordinates'])), dtype=float)
+                        minx, miny = points[:, :2].min(axis=0).tolist()
+                        maxx, maxy = points[:, :2].max(axis=0).tolist()
                         location = f"{miny},{minx},{maxy},{maxx}"
                         print(f"✅ Found Brooklyn bounding box: {location}")
                         break
@@ -140,5 +138,6 @@ def main(location: str | None = None, name: str = "brooklyn_project"):
             location = "40.5707,-74.0419,40.7395,-73.8334" # Fallback Brooklyn bbox
 
     print(f"🚀 Sending job to Modal...")
-    output_path = run_tile2net.remote(location, name, boundary_path=remote_boundary_path) # type: ignore
+    info_path = prepare_tiles.remote(location, name, boundary_path=remote_boundary_path) # type: ignore
+    output_path = run_tile2net.remote(info_path) # type: ignore
     print(f"Remote execution finished. Data located at: {output_path}")
\ No newline at end of file
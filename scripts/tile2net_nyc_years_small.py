@@ -1,64 +1,31 @@
 import modal
 import os
 
-image = (
-    modal.Image.debian_slim(python_version="3.10")
-    .apt_install(
-        "git", "libgdal-dev", "gdal-bin", "libspatialindex-dev",
-        "libgl1", "libglib2.0-0"
-    )
-    .pip_install(
-        "numpy<2.0",
-        "git+https://github.com/VIDA-NYU/tile2net.git",
-        "urllib3<2.0"
-    )
-)
+from tile2net_common import image, nyc_xyz_source, run_inference, vol
 
 app = modal.App("tile2net-nyc-historical")
-vol = modal.Volume.from_name("tile2net-data", create_if_missing=True)
 
-@app.function(
-    image=image,
-    gpu="A100-80GB",
-    cpu=4,
-    memory=16384,
-    timeout=86400,
-    volumes={"/data": vol}
-)
-def run_brooklyn_history(year: int):
+# tile2net runs inference one tile per batch unless --bs_val is given;
+# the A100-80GB has room for far more
+INFERENCE_BATCH_SIZE = 32
+
+def brooklyn_raster(year: int):
+    """Build the tile2net Raster for one year of NYC aerial photography."""
     from tile2net import Raster
-    from tile2net.raster.source import Source
-    
-    # --- DEFINE CUSTOM SOURCES ---
-    
-    class NYC_XYZ_Source(Source):
-        ignore = True 
-        
-        def __init__(self, target_year):
-            self.year = target_year
-            self.tiles = f'https://maps.nyc.gov/xyz/1.0.0/photo/{target_year}/{{z}}/{{x}}/{{y}}.png8'
-            self.server = f'https://maps.nyc.gov/xyz/1.0.0/photo/{target_year}'
-            self.zoom = 19
-            self.extension = 'png'
-            self.name = f'nyc_{target_year}'
-            self.keyword = 'New York City'
 
     location = [40.7000, -74.0000, 40.6500, -73.9300]
     project_name = f"bk_central_{year}"
     output_dir = "/data/outputs"
     os.makedirs(output_dir, exist_ok=True)
 
-    print(f"⏳ Processing Year: {year}")
-    
     # Instantiate the source
     if year in [2008, 2010, 2012, 2014, 2016, 2018]:
-        source = NYC_XYZ_Source(year)
+        source = nyc_xyz_source(year)
     else:
         print(f"⚠️ Year {year} might not be hosted on NYC XYZ. Trying generic...")
-        source = NYC_XYZ_Source(year)
+        source = nyc_xyz_source(year)
 
-    # Initialize Raster
-    raster = Raster(
+    return Raster(
         location=location,
         name=project_name,
         output_dir=output_dir,
@@ -66,14 +33,33 @@ def run_brooklyn_history(year: int):
         zoom=19
     )
 
-    # --- EXECUTION ---
+# Download and stitch on CPU (see tile2net_common)
+@app.function(
+    image=image,
+    cpu=8,
+    timeout=86400,
+    volumes={"/data": vol}
+)
+def prepare_tiles(year: int):
     print(f"⬇️  Downloading tiles for {year}...")
-    raster.generate(4) 
+    raster = brooklyn_raster(year)
+    raster.generate(4)
+    vol.commit()
+    return str(raster.project.tiles.info)
+
+@app.function(
+    image=image,
+    gpu="A100-80GB",
+    cpu=4,
+    memory=16384,
+    timeout=86400,
+    volumes={"/data": vol}
+)
+def run_brooklyn_history(year: int, info_path: str):
+    print(f"⏳ Processing Year: {year}")
     
     print(f"🧠 Running Inference for {year}...")
-    raster.inference()
-    
-    return f"{output_dir}/{project_name}"
+    return run_inference(info_path, "--bs_val", str(INFERENCE_BATCH_SIZE))
 
 @app.local_entrypoint()
 def main():
@@ -90,13 +76,27 @@ def main():
         # 2022, # worked
         ]
     
-    for year in years_to_process:
-        print(f"\n🚀 Starting job for {year}...")
-        try:
-            output_path = run_brooklyn_history.remote(year)
-            print(f"✅ Finished {year}. Data at: {output_path}")
-        except Exception as e:
-            print(f"❌ Failed {year}: {e}")
+    print(f"\n🚀 Starting jobs for {years_to_process}...")
+    
+    # Years are independent, so run them as parallel containers; exceptions
+    # come back as results so one failed year doesn't hide the others.
+    # Downloads all run on CPU first; a year that fails there never
+    # starts an A100.
+    ready, infos = [], []
+    prepared = prepare_tiles.map(years_to_process, return_exceptions=True)
+    for year, result in zip(years_to_process, prepared):
+        if isinstance(result, Exception):
+            print(f"❌ Failed {year} while downloading: {result}")
+        else:
+            ready.append(year)
+            infos.append(result)
+
+    results = run_brooklyn_history.map(ready, infos, return_exceptions=True)
+    for year, result in zip(ready, results):
+        if isinstance(result, Exception):
+            print(f"❌ Failed {year}: {result}")
+        else:
+            print(f"✅ Finished {year}. Data at: {result}")
 
     print("\nTo download results:")
     for year in years_to_process:
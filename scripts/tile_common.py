@@ -0,0 +1,59 @@
+"""
+Shared tile decoding for download_nyc_tiles and stitch_tiles: one tile file
+in, one RGB array plus its brightness out, ready to copy into a mosaic.
+"""
+
+import numpy as np
+from PIL import Image
+
+
+def palette_brightness(tile):
+    """Mean grayscale value of a 'P' image, from its histogram and palette."""
+    lut = Image.new('P', (256, 1))
+    lut.putpalette(tile.getpalette())
+    lut.putdata(range(256))
+    gray = np.asarray(lut.convert('L'), dtype=np.int64)[0]
+    counts = np.asarray(tile.histogram(), dtype=np.int64)
+    return float(counts @ gray) / (tile.width * tile.height)
+
+
+def decode_tile(filepath, tile_size=256, background=None):
+    """
+    Decode one tile for stitching.
+
+    Returns (rgb, avg_brightness, error): the tile as a (tile_size,
+    tile_size, 3) uint8 array, its mean grayscale value (None for modes
+    other than P, RGB and RGBA), and the exception if it could not be
+    loaded. A tile of another size is resized to tile_size, with a warning,
+    so it still fills its grid cell. RGBA tiles with transparent pixels are
+    composited over the background color when one is given; otherwise, and
+    for fully opaque tiles, the alpha channel is simply dropped.
+    """
+    try:
+        tile = Image.open(filepath)
+
+        # Check if tile is mostly black; average the grayscale pixels as an
+        # array instead of a list of Python ints
+        avg_brightness = None
+        if tile.mode == 'P':
+            # Palette tiles (the .png8 format): weight each palette entry's
+            # gray value by its pixel count instead of expanding the tile
+            avg_brightness = palette_brightness(tile)
+        elif tile.mode in ('RGB', 'RGBA'):
+            avg_brightness = float(np.asarray(tile.convert('L')).mean())
+
+        if tile.size != (tile_size, tile_size):
+            print(f"⚠️  Resizing {filepath}: {tile.width}x{tile.height} tile, expected {tile_size}x{tile_size}")
+            if tile.mode == 'P':
+                tile = tile.convert('RGBA' if 'transparency' in tile.info else 'RGB')
+            tile = tile.resize((tile_size, tile_size), Image.Resampling.BILINEAR)
+
+        if (background is not None and tile.mode == 'RGBA'
+                and tile.getchannel('A').getextrema()[0] < 255):
+            rgb = Image.new('RGB', tile.size, background)
+            rgb.paste(tile, (0, 0), tile)
+        else:
+            rgb = tile.convert('RGB')
+        return np.asarray(rgb), avg_brightness, None
+    except Exception as e:
+        return None, None, e